@@ -1,32 +1,37 @@
+import argparse
+import concurrent.futures
 import dataclasses
+import functools
 from datetime import date, datetime
-from typing import Optional, List, Dict, Any
-import json
+from typing import Optional, List, Dict, Any, Tuple
 import os
-import glob
-from thefuzz import fuzz  # For fuzzy string matching
+import heapq
+import sys
+from collections import defaultdict
+import orjson
+from rapidfuzz import fuzz, process  # For fuzzy string matching
 
 
 # --- Dataclass definitions (copied from your provided code for standalone functionality) ---
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class WarehouseData:
     location: Optional[str] = None
     quantity_available: Optional[int] = None
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class Size:
     units: Optional[str] = None
     value: Optional[float] = None  # Changed to float to match user's definition
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class Price:
     units: Optional[str] = None
     value: Optional[float] = None
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class GreenData:
     name: Optional[str] = None
     url: Optional[str] = None
@@ -47,13 +52,26 @@ SIMILARITY_THRESHOLD_NAME = 85
 SIMILARITY_THRESHOLD_COUNTRY = 95
 SIMILARITY_THRESHOLD_FARM = 80
 
+_GREENDATA_FIELDS = frozenset(field.name for field in dataclasses.fields(GreenData))
+# Low-cardinality fields repeated across thousands of offerings; interning keeps one copy of each value.
+_INTERNED_FIELDS = ('url', 'importer', 'country', 'variety')
+
 def _parse_iso_date(date_str: Optional[str]) -> Optional[date]:
     """Safely parses an ISO format date string to a date object."""
     if not date_str:
         return None
+    if not isinstance(date_str, str):
+        print(f"Warning: Could not parse date string '{date_str}' as ISO date.")
+        return None
+    return _parse_iso_date_str(date_str)
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_iso_date_str(date_str: str) -> Optional[date]:
+    """Cached ISO parse; a daily dump repeats the same handful of added/arrival dates."""
     try:
         return date.fromisoformat(date_str)
-    except (ValueError, TypeError):
+    except ValueError:
         # Fallback for unexpected date formats, though JSON should be ISO.
         print(f"Warning: Could not parse date string '{date_str}' as ISO date.")
         return None
@@ -61,38 +79,65 @@ def _parse_iso_date(date_str: Optional[str]) -> Optional[date]:
 
 def _dict_to_greendata(data_dict: Dict[str, Any]) -> GreenData:
     """Converts a dictionary (from JSON) to a GreenData object."""
-    return GreenData(
-        name=data_dict.get('name'),
-        url=data_dict.get('url'),
-        importer=data_dict.get('importer'),  # Added line
-        farm=data_dict.get('farm'),
-        country=data_dict.get('country'),
-        arrival=_parse_iso_date(data_dict.get('arrival')),
-        cupping_notes=data_dict.get('cupping_notes'),
-        variety=data_dict.get('variety'),
-        quantity_available=[WarehouseData(**wh) for wh in data_dict.get('quantity_available', []) if
-                            isinstance(wh, dict)],
-        size=Size(**data_dict['size']) if data_dict.get('size') and isinstance(data_dict['size'], dict) else None,
-        price=Price(**data_dict['price']) if data_dict.get('price') and isinstance(data_dict['price'], dict) else None,
-        added=_parse_iso_date(data_dict.get('added')),
-        removed=_parse_iso_date(data_dict.get('removed'))
-    )
+    # Plain fields pass straight through; only the typed ones need converting.
+    kwargs = {key: data_dict[key] for key in data_dict.keys() & _GREENDATA_FIELDS}
+    for key in _INTERNED_FIELDS:
+        value = kwargs.get(key)
+        if isinstance(value, str):
+            kwargs[key] = sys.intern(value)
+    kwargs['arrival'] = _parse_iso_date(kwargs.get('arrival'))
+    kwargs['added'] = _parse_iso_date(kwargs.get('added'))
+    kwargs['removed'] = _parse_iso_date(kwargs.get('removed'))
+    kwargs['quantity_available'] = [WarehouseData(**wh) for wh in kwargs.get('quantity_available') or [] if
+                                    isinstance(wh, dict)]
+    size, price = kwargs.get('size'), kwargs.get('price')
+    kwargs['size'] = Size(**size) if size and isinstance(size, dict) else None
+    kwargs['price'] = Price(**price) if price and isinstance(price, dict) else None
+    return GreenData(**kwargs)
+
+
+def _greendata_to_report_dict(offering: GreenData) -> Dict[str, Any]:
+    """Flat dict form of a GreenData for reports; a cheap stand-in for dataclasses.asdict."""
+    size, price = offering.size, offering.price
+    return {
+        'name': offering.name,
+        'url': offering.url,
+        'importer': offering.importer,
+        'farm': offering.farm,
+        'country': offering.country,
+        'arrival': offering.arrival,
+        'cupping_notes': offering.cupping_notes,
+        'variety': offering.variety,
+        'quantity_available': [{'location': wh.location, 'quantity_available': wh.quantity_available}
+                               for wh in offering.quantity_available],
+        'size': {'units': size.units, 'value': size.value} if size is not None else None,
+        'price': {'units': price.units, 'value': price.value} if price is not None else None,
+        'added': offering.added,
+        'removed': offering.removed,
+    }
 
 
 def load_coffee_data_from_file(file_path: str) -> Dict[str, List[GreenData]]:
     """Loads coffee data from a JSON file and converts it to GreenData objects."""
     try:
-        with open(file_path, 'r') as f:
-            raw_data = json.load(f)
+        with open(file_path, 'rb') as f:
+            raw_data = orjson.loads(f.read())
     except FileNotFoundError:
         print(f"Error: File not found - {file_path}")
         return {}
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         print(f"Error: Could not decode JSON from - {file_path}")
         return {}
 
+    if not isinstance(raw_data, dict):
+        print(f"Error: Expected a JSON object keyed by source in - {file_path}")
+        return {}
+
+    # Pop each site's raw dicts as it is converted, so the raw and dataclass forms of the whole
+    # dump are never held in memory at the same time.
     structured_data: Dict[str, List[GreenData]] = {}
-    for site_url, offerings_list in raw_data.items():
+    for site_url in list(raw_data):
+        offerings_list = raw_data.pop(site_url)
         if not isinstance(offerings_list, list):
             print(f"Warning: Expected a list of offerings for URL '{site_url}', got {type(offerings_list)}. Skipping.")
             structured_data[site_url] = []
@@ -110,22 +155,27 @@ def find_latest_json_files(directory: str, source_type: str) -> tuple[
     Filename format: daily_coffee_data_{source_type}_YYYYMMDD.json
     """
     file_prefix = f"daily_coffee_data_{source_type}_"
-    file_pattern = os.path.join(directory, f"{file_prefix}*.json")
-    files = glob.glob(file_pattern)
+    try:
+        with os.scandir(directory) as entries:
+            filenames = [entry.name for entry in entries
+                         if entry.name.startswith(file_prefix) and entry.name.endswith(".json")]
+    except FileNotFoundError:
+        return None, None
 
     dated_files = []
-    for f_path in files:
-        filename = os.path.basename(f_path)
+    for filename in filenames:
+        # Remove prefix and suffix to get the date string; slicing YYYYMMDD avoids strptime's locale handling.
+        date_str = filename[len(file_prefix):-len(".json")]
         try:
-            # Remove prefix and suffix to get the date string
-            date_str = filename[len(file_prefix):-len(".json")]
-            file_date = datetime.strptime(date_str, "%Y%m%d").date()
-            dated_files.append((file_date, f_path))
+            if len(date_str) != 8 or not date_str.isdigit():
+                raise ValueError(date_str)
+            file_date = date(int(date_str[:4]), int(date_str[4:6]), int(date_str[6:]))
         except ValueError:
             print(f"Warning: Could not parse date from filename: {filename} with prefix {file_prefix}")
             continue
+        dated_files.append((file_date, os.path.join(directory, filename)))
 
-    dated_files.sort(key=lambda x: x[0], reverse=True)
+    dated_files = heapq.nlargest(2, dated_files, key=lambda x: x[0])
 
     if len(dated_files) >= 2:
         return dated_files[0][1], dated_files[1][1]  # latest, second_latest
@@ -134,65 +184,181 @@ def find_latest_json_files(directory: str, source_type: str) -> tuple[
     return None, None
 
 
-def are_offerings_similar(offering1: GreenData, offering2: GreenData) -> bool:
-    if not offering1.name or not offering2.name:
+def _normalize_offering(offering: GreenData) -> Tuple[str, str, str]:
+    """Lowercased (name, country, farm) for comparisons; a blank farm normalizes to ''."""
+    farm = offering.farm if offering.farm and offering.farm.strip() else ''
+    return (offering.name or '').lower(), (offering.country or '').strip().lower(), farm.lower()
+
+
+def _length_rules_out(value1: str, value2: str, threshold: float) -> bool:
+    """
+    True when the lengths alone keep fuzz.ratio(value1, value2) below threshold.
+    The best possible ratio is 200 * min(len) / (len1 + len2), reached when the
+    shorter string is a subsequence of the longer one.
+    """
+    return 200 * min(len(value1), len(value2)) < threshold * (len(value1) + len(value2))
+
+
+def _countries_match(country1: str, country2: str) -> bool:
+    """Normalized countries match when either is blank or they meet SIMILARITY_THRESHOLD_COUNTRY."""
+    if not country1 or not country2 or country1 == country2:
         return True
+    return not _length_rules_out(country1, country2, SIMILARITY_THRESHOLD_COUNTRY) and bool(
+        fuzz.ratio(country1, country2, score_cutoff=SIMILARITY_THRESHOLD_COUNTRY))
+
 
+def _farms_match(farm1: str, farm2: str) -> bool:
+    """Normalized farms match when either is blank or they meet SIMILARITY_THRESHOLD_FARM."""
+    if not farm1 or not farm2:
+        return True
+    return not _length_rules_out(farm1, farm2, SIMILARITY_THRESHOLD_FARM) and bool(
+        fuzz.ratio(farm1, farm2, score_cutoff=SIMILARITY_THRESHOLD_FARM))
 
-    name_similarity = fuzz.ratio(offering1.name.lower(), offering2.name.lower())
-    if name_similarity < SIMILARITY_THRESHOLD_NAME:
+
+def _any_farm_matches(farm: str, candidate_farms: List[str]) -> bool:
+    """Whether _farms_match(farm, candidate) holds for any of candidate_farms."""
+    if not candidate_farms:
         return False
+    if not farm or '' in candidate_farms:
+        return True
+    # extractOne preprocesses the query once and reuses it across every candidate.
+    return process.extractOne(farm, candidate_farms, scorer=fuzz.ratio,
+                              score_cutoff=SIMILARITY_THRESHOLD_FARM) is not None
 
-    if offering1.country and offering2.country:
-        country_similarity = fuzz.ratio(offering1.country.lower(), offering2.country.lower())
-        if country_similarity < SIMILARITY_THRESHOLD_COUNTRY:
-            if name_similarity < (SIMILARITY_THRESHOLD_NAME + 5):
-                return False
-    elif (offering1.country and offering2.country) and offering1.country != offering2.country:
+
+def _passes_attribute_checks(normalized1: Tuple[str, str, str], normalized2: Tuple[str, str, str],
+                             name_similarity: float) -> bool:
+    """Country and farm checks for a pair whose names already meet SIMILARITY_THRESHOLD_NAME."""
+    _, country1, farm1 = normalized1
+    _, country2, farm2 = normalized2
+
+    if name_similarity < (SIMILARITY_THRESHOLD_NAME + 5) and not _countries_match(country1, country2):
         return False
 
-    if offering1.farm and offering1.farm.strip() and offering2.farm and offering2.farm.strip():
-        farm_similarity = fuzz.ratio(offering1.farm.lower(), offering2.farm.lower())
-        if farm_similarity < SIMILARITY_THRESHOLD_FARM:
+    return _farms_match(farm1, farm2)
+
+
+def are_offerings_similar(offering1: GreenData, offering2: GreenData) -> bool:
+    if not offering1.name or not offering2.name:
+        return True
+
+    normalized1, normalized2 = _normalize_offering(offering1), _normalize_offering(offering2)
+    if normalized1[0] == normalized2[0]:
+        # Re-listed offerings usually keep their exact name; no need for an edit distance.
+        name_similarity = 100
+    else:
+        if _length_rules_out(normalized1[0], normalized2[0], SIMILARITY_THRESHOLD_NAME):
+            return False
+        # With score_cutoff, fuzz.ratio stops early and returns 0 for anything below the threshold.
+        name_similarity = fuzz.ratio(normalized1[0], normalized2[0], score_cutoff=SIMILARITY_THRESHOLD_NAME)
+        if not name_similarity:
             return False
 
-    return True
+    return _passes_attribute_checks(normalized1, normalized2, name_similarity)
 
 
-def compare_coffee_data(
-        old_data: Dict[str, List[GreenData]],
-        new_data: Dict[str, List[GreenData]]
+def _compare_site(
+        site_url: str,
+        new_offerings_list: List[GreenData],
+        old_offerings_list: List[GreenData]
 ) -> List[Dict[str, Any]]:
+    """Reports the offerings in new_offerings_list that have no similar match in old_offerings_list."""
     new_offerings_report: List[Dict[str, Any]] = []
+    if not old_offerings_list:
+        return new_offerings_report
 
-    for site_url, new_offerings_list in new_data.items():
-        old_offerings_list = old_data.get(site_url, [])
-        if not old_offerings_list:
+    new_items = []
+    for new_item in new_offerings_list:
+        if not new_item.name:  # Skip items without a name
+            print(f"Warning: New item from {site_url} has no name, skipping: {new_item}")
             continue
-
-        for new_item in new_offerings_list:
-            if not new_item.name:  # Skip items without a name
-                print(f"Warning: New item from {site_url} has no name, skipping: {new_item}")
-                continue
-
-            is_truly_new = True
-            for old_item in old_offerings_list:
-                if not old_item.name:  # Skip old items without a name for comparison
-                    continue
-                if are_offerings_similar(new_item, old_item):
-                    is_truly_new = False
-                    break
-
-            if is_truly_new:
-                new_offerings_report.append({
-                    "source_site": site_url,
-                    "offering": dataclasses.asdict(new_item)  # Store as dict for easy serialization/inspection
-                })
+        new_items.append(new_item)
+
+    # Normalize each offering once up front rather than on every pairwise comparison.
+    # Old items without a name are skipped for comparison.
+    new_normalized = [_normalize_offering(new_item) for new_item in new_items]
+    old_normalized = [_normalize_offering(old_item) for old_item in old_offerings_list if old_item.name]
+
+    # Block both sides by normalized country. A pair of blocks whose countries match only needs
+    # the name threshold; otherwise the name alone has to clear the threshold + 5 override.
+    # Matching blocks go first so most items are settled before the stricter cross-country pass.
+    # Within a block, old offerings are indexed by normalized name so repeated names are scored once.
+    new_by_country: Dict[str, List[int]] = defaultdict(list)
+    for new_index, normalized in enumerate(new_normalized):
+        new_by_country[normalized[1]].append(new_index)
+    old_by_country: Dict[str, Dict[str, List[int]]] = defaultdict(lambda: defaultdict(list))
+    for old_index, (name, country, _) in enumerate(old_normalized):
+        old_by_country[country][name].append(old_index)
+
+    # An exact name match scores 100, which clears the cross-country override, so only the farm
+    # needs checking. Settle those with a hash lookup before any fuzzy scoring.
+    old_by_name: Dict[str, List[int]] = defaultdict(list)
+    for old_index, normalized in enumerate(old_normalized):
+        old_by_name[normalized[0]].append(old_index)
+    is_truly_new = [
+        not _any_farm_matches(farm, [old_normalized[old_index][2] for old_index in old_by_name.get(name, ())])
+        for name, _, farm in new_normalized
+    ]
+
+    for new_country, new_indices in new_by_country.items():
+        blocks = sorted(
+            ((not _countries_match(new_country, old_country), old_name_index)
+             for old_country, old_name_index in old_by_country.items()),
+            key=lambda block: block[0],
+        )
+
+        for is_cross_country, old_name_index in blocks:
+            pending_by_name: Dict[str, List[int]] = defaultdict(list)
+            for new_index in new_indices:
+                if is_truly_new[new_index]:
+                    pending_by_name[new_normalized[new_index][0]].append(new_index)
+            if not pending_by_name:
+                break
+
+            # Score the whole block in one call; pairs below the cutoff come back as 0.
+            name_cutoff = SIMILARITY_THRESHOLD_NAME + 5 if is_cross_country else SIMILARITY_THRESHOLD_NAME
+            old_names = list(old_name_index)
+            name_scores = process.cdist(
+                list(pending_by_name),
+                old_names,
+                scorer=fuzz.ratio,
+                score_cutoff=name_cutoff,
+                workers=1,
+            )
+
+            for pending_indices, row in zip(pending_by_name.values(), name_scores):
+                candidate_farms = [old_normalized[old_index][2]
+                                   for name_position in row.nonzero()[0]
+                                   for old_index in old_name_index[old_names[name_position]]]
+                for new_index in pending_indices:
+                    if _any_farm_matches(new_normalized[new_index][2], candidate_farms):
+                        is_truly_new[new_index] = False
+
+    for new_item, new_is_truly_new in zip(new_items, is_truly_new):
+        if new_is_truly_new:
+            new_offerings_report.append({
+                "source_site": site_url,
+                "offering": _greendata_to_report_dict(new_item)  # Store as dict for easy serialization/inspection
+            })
 
     return new_offerings_report
 
 
-def main_comparison():
+def compare_coffee_data(
+        old_data: Dict[str, List[GreenData]],
+        new_data: Dict[str, List[GreenData]]
+) -> List[Dict[str, Any]]:
+    # Sites are independent, and rapidfuzz releases the GIL while scoring, so they run on a thread pool.
+    # Each cdist call stays single-threaded to avoid oversubscribing the cores.
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        futures = [
+            executor.submit(_compare_site, site_url, new_offerings_list, old_data.get(site_url, []))
+            for site_url, new_offerings_list in new_data.items()
+        ]
+        return [new_offering for future in futures for new_offering in future.result()]
+
+
+def main_comparison(pretty: bool = False):
     data_folder = "green_data"
     source_types = ["sites", "pdfs"]
     all_newly_found_offerings: List[Dict[str, Any]] = []
@@ -229,7 +395,7 @@ def main_comparison():
                             all_newly_found_offerings.append({
                                 "source_file_type": source_type,
                                 "source_document": source_key,
-                                "offering": dataclasses.asdict(item)
+                                "offering": _greendata_to_report_dict(item)
                             })
             else:
                 newly_found_for_source = compare_coffee_data(prior_data, latest_data)
@@ -254,12 +420,16 @@ def main_comparison():
             print(f"    Name: {offering_name}, Country: {offering_country}, Importer: {importer_name}")
 
         output_filename = f"new_offerings_report_combined_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-        with open(output_filename, 'w') as f:
-            json.dump(all_newly_found_offerings, f, indent=4, default=str)
+        # orjson writes date fields as ISO strings natively, so no default=str fallback is needed.
+        # The report is compact unless a human-readable copy is asked for.
+        with open(output_filename, 'wb') as f:
+            f.write(orjson.dumps(all_newly_found_offerings, option=orjson.OPT_INDENT_2 if pretty else None))
         print(f"\nCombined new offerings report saved to: {output_filename}")
     else:
         print("\nNo new offerings found across all sources.")
 
 
 if __name__ == "__main__":
-    main_comparison()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Report green coffee offerings that are new since the prior snapshot.")
+    parser.add_argument("--pretty", action="store_true", help="indent the JSON report for reading")
+    main_comparison(pretty=parser.parse_args().pretty)
\ No newline at end of file
@@ -1,19 +1,57 @@
 import dataclasses
+import functools
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import date, datetime
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 import json
+import orjson
 import os
+import re
+from urllib.parse import urljoin
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import openai
+import tiktoken
 from bs4 import BeautifulSoup
 from dateparser import parse
 from dotenv import load_dotenv
 import hashlib
-import PyPDF2
+import threading
+import time
+import pymupdf
 
 load_dotenv()
 OPENAI_KEY = os.getenv("OPENAI_KEY")
-PDF_HASH_FILE = "processed_pdf_hashes.json"
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+PDF_HASH_FILE = "processed_pdf_hashes.jsonl"
+PDF_HASH_INDEX_FILE = "pdf_hash_index.json"  # path -> size/mtime/sha256, to skip rehashing unchanged files
+HTML_HASH_FILE = "processed_html_hashes.json"
+HASH_BLOCK_SIZE = 1024 * 1024
+PDF_PAGES_PER_TASK = 25  # long PDFs are split into page ranges of this size for text extraction
+MAX_CONCURRENT_FETCHES = 8  # keep concurrent requests per run polite for the importer sites
+MAX_CONCURRENT_AI_REQUESTS = 5
+OPENAI_MAX_RETRIES = 5  # the client backs off exponentially on 429s and transient errors
+COFFEE_RE = re.compile(r"\b(coffee|arabica|robusta|green bean|lot|origin)\b", re.IGNORECASE)
+NON_CONTENT_TAGS = ["script", "style", "noscript", "svg", "iframe", "template"]
+FAST_DATE_FORMATS = ("%Y-%m-%d", "%B %Y", "%b %Y", "%Y")
+MAX_DOCUMENT_TOKENS = 30000  # per-document budget for the text sent to the model
+SMALL_DOCUMENT_CHARS = 4000  # pages at most this long share a single extraction call
+MAX_BATCH_DOCUMENTS = 8
+AI_CACHE_DIR = "openai_cache"
+AI_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+
+# One shared client keeps its HTTP connection pool alive across every extraction call (it is thread-safe).
+CLIENT = openai.OpenAI(api_key=OPENAI_KEY, max_retries=OPENAI_MAX_RETRIES) if OPENAI_KEY else None
+
+# Shared session so repeat requests to the same host reuse connections; transient failures are retried with backoff.
+SESSION = requests.Session()
+SESSION.headers['User-Agent'] = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=MAX_CONCURRENT_FETCHES,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 502, 503, 504]),
+))
 
 URL_LIST = [
     'https://yellowroostercoffee.com/coffees/',
@@ -67,12 +105,14 @@ class GreenData:
 
 
 def calculate_file_hash(filepath: str) -> str:
-    sha256_hash = hashlib.sha256()
     try:
         with open(filepath, "rb") as f:
-            for byte_block in iter(lambda: f.read(4096), b""):
+            if hasattr(hashlib, "file_digest"):  # Python 3.11+
+                return hashlib.file_digest(f, "sha256").hexdigest()
+            sha256_hash = hashlib.sha256()
+            for byte_block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
                 sha256_hash.update(byte_block)
-        return sha256_hash.hexdigest()
+            return sha256_hash.hexdigest()
     except FileNotFoundError:
         print(f"Error: File not found at {filepath} for hashing.")
         return ""
@@ -81,12 +121,62 @@ def calculate_file_hash(filepath: str) -> str:
         return ""
 
 
+def load_pdf_hash_index() -> Dict[str, Dict[str, Any]]:
+    if not os.path.exists(PDF_HASH_INDEX_FILE):
+        return {}
+    try:
+        with open(PDF_HASH_INDEX_FILE, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Error loading PDF hash index: {e}. Rehashing all PDFs.")
+        return {}
+
+
+def save_pdf_hash_index(index: Dict[str, Dict[str, Any]]):
+    try:
+        with open(PDF_HASH_INDEX_FILE, 'w') as f:
+            json.dump(index, f)
+    except Exception as e:
+        print(f"Error saving PDF hash index: {e}")
+
+
+def calculate_pdf_hashes(pdf_paths: List[str], executor: ProcessPoolExecutor) -> List[str]:
+    """
+    Hashes each PDF, reusing the stored hash when its size and mtime are unchanged since it was
+    last hashed, so only new or modified files are read in full.
+    """
+    index = load_pdf_hash_index()
+    hashes: Dict[str, str] = {}
+    stale_paths = []
+    for pdf_path in pdf_paths:
+        try:
+            st = os.stat(pdf_path)
+        except OSError:
+            stale_paths.append(pdf_path)  # calculate_file_hash reports the error
+            continue
+        entry = index.get(pdf_path)
+        if entry and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+            hashes[pdf_path] = entry["sha256"]
+        else:
+            stale_paths.append(pdf_path)
+
+    for pdf_path, file_hash in zip(stale_paths, executor.map(calculate_file_hash, stale_paths)):
+        hashes[pdf_path] = file_hash
+        if file_hash:
+            st = os.stat(pdf_path)
+            index[pdf_path] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": file_hash}
+
+    if stale_paths:
+        save_pdf_hash_index(index)
+    return [hashes[pdf_path] for pdf_path in pdf_paths]
+
+
 def load_processed_pdf_hashes() -> set:
     if not os.path.exists(PDF_HASH_FILE):
         return set()
     try:
         with open(PDF_HASH_FILE, 'r') as f:
-            return set(json.load(f))
+            return {json.loads(line) for line in f if line.strip()}
     except json.JSONDecodeError:
         print(f"Warning: Could not decode {PDF_HASH_FILE}. Starting with an empty set of hashes.")
         return set()
@@ -95,24 +185,65 @@ def load_processed_pdf_hashes() -> set:
         return set()
 
 
-def save_processed_pdf_hashes(hashes: set):
+def append_processed_pdf_hashes(new_hashes: set):
+    """Appends one JSON-encoded hash per line, so a session only writes the hashes it added."""
     try:
-        with open(PDF_HASH_FILE, 'w') as f:
-            json.dump(list(hashes), f, indent=4)
+        with open(PDF_HASH_FILE, 'a') as f:
+            f.writelines(json.dumps(file_hash) + "\n" for file_hash in sorted(new_hashes))
     except Exception as e:
         print(f"Error saving PDF hashes: {e}")
 
 
-def extract_text_from_pdf(pdf_path: str) -> Optional[str]:
+def green_data_from_dict(item: Dict[str, Any]) -> GreenData:
+    """Rebuilds a GreenData from its serialized dict form (ISO date strings, nested dicts)."""
+    return GreenData(
+        name=item.get("name"),
+        url=item.get("url"),
+        importer=item.get("importer"),
+        farm=item.get("farm"),
+        country=item.get("country"),
+        arrival=date.fromisoformat(item["arrival"]) if item.get("arrival") else None,
+        cupping_notes=item.get("cupping_notes"),
+        variety=item.get("variety"),
+        quantity_available=[WarehouseData(**wh) for wh in item.get("quantity_available") or []],
+        size=Size(**item["size"]) if item.get("size") else None,
+        price=Price(**item["price"]) if item.get("price") else None,
+        added=date.fromisoformat(item["added"]) if item.get("added") else None,
+        removed=date.fromisoformat(item["removed"]) if item.get("removed") else None,
+    )
+
+
+def load_processed_html_hashes() -> Dict[str, Dict[str, Any]]:
+    """Returns {url: {"hash": sha256 of the page body, "items": [GreenData dicts from that body]}}."""
+    if not os.path.exists(HTML_HASH_FILE):
+        return {}
     try:
-        text = ""
-        with open(pdf_path, 'rb') as file:
-            reader = PyPDF2.PdfReader(file)
-            for page_num in range(len(reader.pages)):
-                page = reader.pages[page_num]
-                text += page.extract_text() or ""
-        return text
-    except FileNotFoundError:
+        with open(HTML_HASH_FILE, 'r') as f:
+            return json.load(f)
+    except json.JSONDecodeError:
+        print(f"Warning: Could not decode {HTML_HASH_FILE}. Starting with an empty set of hashes.")
+        return {}
+    except Exception as e:
+        print(f"Error loading HTML hashes: {e}. Starting with an empty set.")
+        return {}
+
+
+def save_processed_html_hashes(hashes: Dict[str, Dict[str, Any]]):
+    try:
+        with open(HTML_HASH_FILE, 'wb') as f:
+            f.write(orjson.dumps(hashes, option=orjson.OPT_INDENT_2))
+    except Exception as e:
+        print(f"Error saving HTML hashes: {e}")
+
+
+def extract_text_from_pdf(pdf_path: str, start_page: int = 0, stop_page: Optional[int] = None,
+                          stream: Optional[bytes] = None) -> Optional[str]:
+    """Extracts the text of `pdf_path`, or of the PDF bytes in `stream` (with `pdf_path` only naming it in errors)."""
+    try:
+        with (pymupdf.open(stream=stream, filetype="pdf") if stream is not None else pymupdf.open(pdf_path)) as doc:
+            stop_page = doc.page_count if stop_page is None else min(stop_page, doc.page_count)
+            return "".join(doc[i].get_text("text") for i in range(start_page, stop_page))
+    except (FileNotFoundError, pymupdf.FileNotFoundError):
         print(f"Error: PDF file not found at {pdf_path}")
         return None
     except Exception as e:
@@ -120,98 +251,213 @@ def extract_text_from_pdf(pdf_path: str) -> Optional[str]:
         return None
 
 
-def extract_structured_data_from_pdf_text_via_ai(pdf_text_content: str, pdf_filename: str) -> List[GreenData]:
-    if not OPENAI_KEY:
-        print(f"OpenAI API key not available. Skipping AI extraction for {pdf_filename}.")
-        return []
+def extract_texts_from_pdfs(pdf_paths: List[str], executor: ProcessPoolExecutor) -> List[Optional[str]]:
+    """
+    Extracts the text of each PDF, splitting long documents into page ranges so a single large
+    offer sheet is spread across the pool's processes instead of occupying one of them.
+    """
+    page_ranges = []  # (pdf_path, start_page, stop_page)
+    for pdf_path in pdf_paths:
+        try:
+            with pymupdf.open(pdf_path) as doc:
+                page_count = doc.page_count
+        except Exception:
+            page_count = 0  # let extract_text_from_pdf report the error
+        for start_page in range(0, max(page_count, 1), PDF_PAGES_PER_TASK):
+            page_ranges.append((pdf_path, start_page, start_page + PDF_PAGES_PER_TASK))
+
+    futures = [executor.submit(extract_text_from_pdf, *page_range) for page_range in page_ranges]
+    chunks_by_path: Dict[str, List[Optional[str]]] = {pdf_path: [] for pdf_path in pdf_paths}
+    for (pdf_path, _, _), future in zip(page_ranges, futures):
+        chunks_by_path[pdf_path].append(future.result())
+
+    return [None if None in chunks else "".join(chunks)
+            for chunks in (chunks_by_path[pdf_path] for pdf_path in pdf_paths)]
+
+
+@functools.lru_cache(maxsize=None)
+def get_token_encoding() -> Optional[tiktoken.Encoding]:
+    """The model's tokenizer, or None if it can't be loaded (e.g. offline with no cached BPE file)."""
+    try:
+        try:
+            return tiktoken.encoding_for_model(OPENAI_MODEL)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")  # gpt-4o family encoding
+    except Exception as e:
+        print(f"Warning: Could not load the tokenizer for {OPENAI_MODEL}, truncating by UTF-8 bytes instead: {e}")
+        return None
 
-    client = openai.OpenAI(api_key=OPENAI_KEY)
-
-    tools = [
-        {
-            "type": "function",
-            "function": {
-                "name": "extract_coffee_data",
-                "description": "Extracts a list of green coffee bean details from text.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "coffees": {
-                            "type": "array",
-                            "description": "A list of coffee bean data objects found in the text.",
-                            "items": {
-                                "type": "object",
-                                "properties": {
-                                    "name": {"type": "string", "description": "Name of the coffee bean."},
-                                    "url": {"type": "string",
-                                            "description": "Link to the coffee (if available in text, otherwise file path)."},
-                                    "importer": {"type": "string",
-                                                 "description": "Name of the importer or company offering the coffee, if identifiable from the text."},
-                                    # New property
-                                    "farm": {"type": "string", "description": "Name of the farm or estate."},
-                                    "country": {"type": "string", "description": "Country of origin."},
-                                    "arrival": {"type": "string",
-                                                "description": "Arrival date or period (e.g., 'YYYY-MM-DD', 'June 2024', 'Fresh Crop')."},
-                                    "cupping_notes": {"type": "string", "description": "Tasting or cupping notes."},
-                                    "variety": {"type": "string", "description": "Coffee bean variety."},
-                                    "quantity_available": {
-                                        "type": "array",
-                                        "items": {
-                                            "type": "object",
-                                            "properties": {
-                                                "location": {"type": "string"},
-                                                "quantity_available": {"type": "integer"}
-                                            },
-                                            "required": []
-                                        }
-                                    },
-                                    "size": {
-                                        "type": "object",
-                                        "properties": {
-                                            "units": {"type": "string"},
-                                            "value": {"type": "integer"}
-                                        }
-                                    },
-                                    "price": {
+
+def truncate_to_token_budget(content: str) -> str:
+    # Byte-level BPE tokens each cover at least one UTF-8 byte, so the byte length bounds the token count.
+    content_bytes = content.encode()
+    if len(content_bytes) <= MAX_DOCUMENT_TOKENS:
+        return content
+    encoding = get_token_encoding()
+    if encoding is None:
+        return content_bytes[:MAX_DOCUMENT_TOKENS].decode(errors="ignore")
+    tokens = encoding.encode(content, disallowed_special=())
+    if len(tokens) <= MAX_DOCUMENT_TOKENS:
+        return content
+    return encoding.decode(tokens[:MAX_DOCUMENT_TOKENS])
+
+
+def load_cached_ai_response(cache_path: str) -> Optional[str]:
+    try:
+        if time.time() - os.path.getmtime(cache_path) > AI_CACHE_TTL_SECONDS:
+            return None
+        with open(cache_path, 'r') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Error loading cached AI response {cache_path}: {e}")
+        return None
+
+
+def save_cached_ai_response(cache_path: str, function_args_json: str):
+    try:
+        os.makedirs(AI_CACHE_DIR, exist_ok=True)
+        # Write then rename so a concurrent reader never sees a half-written entry.
+        tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(function_args_json)
+        os.replace(tmp_path, cache_path)
+    except Exception as e:
+        print(f"Error saving cached AI response {cache_path}: {e}")
+
+
+def request_extraction_arguments(client, model: str, messages: List[Dict[str, str]], tools: List[Dict[str, Any]],
+                                 source_label: str) -> Optional[str]:
+    """
+    Forces a call to the (single) extraction tool in `tools` and returns its raw JSON arguments.
+    Responses are cached on disk under a hash of the full request (model, prompts, tool schema,
+    temperature), so rerunning on unchanged content does not pay for the same completion twice.
+    """
+    request = {
+        "model": model,
+        "messages": messages,
+        "tools": tools,
+        "tool_choice": {"type": "function", "function": {"name": tools[0]["function"]["name"]}},
+        "temperature": 0.2,
+    }
+    cache_key = hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+    cache_path = os.path.join(AI_CACHE_DIR, f"{cache_key}.json")
+
+    function_args_json = load_cached_ai_response(cache_path)
+    if function_args_json is not None:
+        print(f"Using cached AI response for {source_label}.")
+        return function_args_json
+
+    response = client.chat.completions.create(**request)
+    tool_calls = response.choices[0].message.tool_calls
+    if not tool_calls:
+        print(f"AI did not return any tool calls for {source_label}.")
+        return None
+
+    function_args_json = tool_calls[0].function.arguments
+    save_cached_ai_response(cache_path, function_args_json)
+    return function_args_json
+
+
+# Prompts and tool schemas are module constants so every request shares an identical prefix
+# (tools, then system prompt) that OpenAI can serve from its prompt cache; the document text
+# always goes last in the user message.
+SYSTEM_PROMPT_PDF = ("You are an expert data extraction assistant. "
+                     "Extract information about green coffee beans from the provided text extracted from a PDF document using the available tool. "
+                     "For each coffee, try to identify the importer or company offering it if mentioned. "
+                     "If you are asked for a date, and if the string is a 'month year' or just a year, try your best to give a date, don't provide a string. "
+                     "If no coffee data is found, return an empty list of coffees. "
+                     "Only extract information explicitly present in the text.")
+
+PDF_EXTRACTION_TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "extract_coffee_data",
+            "description": "Extracts a list of green coffee bean details from text.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "coffees": {
+                        "type": "array",
+                        "description": "A list of coffee bean data objects found in the text.",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "name": {"type": "string", "description": "Name of the coffee bean."},
+                                "url": {"type": "string",
+                                        "description": "Link to the coffee (if available in text, otherwise file path)."},
+                                "importer": {"type": "string",
+                                             "description": "Name of the importer or company offering the coffee, if identifiable from the text."},
+                                # New property
+                                "farm": {"type": "string", "description": "Name of the farm or estate."},
+                                "country": {"type": "string", "description": "Country of origin."},
+                                "arrival": {"type": "string",
+                                            "description": "Arrival date or period (e.g., 'YYYY-MM-DD', 'June 2024', 'Fresh Crop')."},
+                                "cupping_notes": {"type": "string", "description": "Tasting or cupping notes."},
+                                "variety": {"type": "string", "description": "Coffee bean variety."},
+                                "quantity_available": {
+                                    "type": "array",
+                                    "items": {
                                         "type": "object",
                                         "properties": {
-                                            "units": {"type": "string"},
-                                            "value": {"type": "number"}
-                                        }
+                                            "location": {"type": "string"},
+                                            "quantity_available": {"type": "integer"}
+                                        },
+                                        "required": []
                                     }
                                 },
-                                "required": ["name"]
-                            }
+                                "size": {
+                                    "type": "object",
+                                    "properties": {
+                                        "units": {"type": "string"},
+                                        "value": {"type": "integer"}
+                                    }
+                                },
+                                "price": {
+                                    "type": "object",
+                                    "properties": {
+                                        "units": {"type": "string"},
+                                        "value": {"type": "number"}
+                                    }
+                                }
+                            },
+                            "required": ["name"]
                         }
-                    },
-                    "required": ["coffees"]
-                }
+                    }
+                },
+                "required": ["coffees"]
             }
         }
-    ]
+    }
+]
+
+
+def extract_structured_data_from_pdf_text_via_ai(pdf_text_content: str, pdf_filename: str) -> List[GreenData]:
+    if not OPENAI_KEY:
+        print(f"OpenAI API key not available. Skipping AI extraction for {pdf_filename}.")
+        return []
+
+    client = CLIENT
 
     try:
         print(f"AI processing for PDF: {pdf_filename}...")
-        response = client.chat.completions.create(
-            model="gpt-4o",
+        function_args_json = request_extraction_arguments(
+            client,
+            model=OPENAI_MODEL,
             messages=[
-                {"role": "system",
-                 "content": "You are an expert data extraction assistant. Extract information about green coffee beans from the provided text extracted from a PDF document using the available tool. For each coffee, try to identify the importer or company offering it if mentioned. If you are asked for a date, and if the string is a 'month year' or just a year, try your best to give a date, don't provide a string. If no coffee data is found, return an empty list of coffees. Only extract information explicitly present in the text."},
+                {"role": "system", "content": SYSTEM_PROMPT_PDF},
                 # Modified prompt
                 {"role": "user",
-                 "content": f"Extract green coffee bean data from the following text content from PDF '{pdf_filename}':\n\n{pdf_text_content[:100000]}"}
+                 "content": f"Extract green coffee bean data from the following text content from PDF '{pdf_filename}':\n\n{truncate_to_token_budget(pdf_text_content)}"}
             ],
-            tools=tools,
-            tool_choice={"type": "function", "function": {"name": "extract_coffee_data"}},
-            temperature=0.2,
+            tools=PDF_EXTRACTION_TOOLS,
+            source_label=pdf_filename,
         )
-
-        tool_calls = response.choices[0].message.tool_calls
-        if not tool_calls:
-            print(f"AI did not return any tool calls for {pdf_filename}.")
+        if function_args_json is None:
             return []
 
-        function_args_json = tool_calls[0].function.arguments
         ai_output = json.loads(function_args_json)
 
         extracted_data_list: List[GreenData] = []
@@ -266,22 +512,30 @@ def extract_structured_data_from_pdf_text_via_ai(pdf_text_content: str, pdf_file
         print(f"An unexpected error occurred during AI extraction for {pdf_filename}: {e}")
     return []
 def fetch_html_content(url: str) -> Optional[str]:
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'
-    }
     try:
-        response = requests.get(url, headers=headers, timeout=20)
+        response = SESSION.get(url, timeout=20)
         response.raise_for_status()
         html_content = response.text
 
-        soup = BeautifulSoup(html_content, 'html.parser')
+        soup = BeautifulSoup(html_content, 'lxml')
         body_tag = soup.find('body')
 
-        if body_tag:
-            return str(body_tag)
-        else:
-            print(f"Warning: No <body> tag found in content from {url}. Returning full HTML.")
-            return html_content  # Fallback to full HTML if no body tag
+        if not body_tag:
+            print(f"Warning: No <body> tag found in content from {url}. Using the full document.")
+            body_tag = soup  # Fallback to the full document if no body tag
+
+        # The model only needs the product text; markup, scripts and inline SVGs are mostly wasted tokens.
+        for tag in body_tag(NON_CONTENT_TAGS):
+            tag.decompose()
+        # Links are kept inline next to their text, since each coffee's URL is one of the extracted fields.
+        for anchor in body_tag.find_all('a', href=True):
+            if anchor['href'].startswith('#'):
+                continue
+            href = urljoin(response.url, anchor['href'])
+            if href.startswith(('http://', 'https://')):
+                link_text = anchor.get_text(" ", strip=True)
+                anchor.string = f"{link_text} ({href})" if link_text else href
+        return body_tag.get_text("\n", strip=True)
 
     except requests.exceptions.HTTPError as e:
         print(f"HTTP error fetching {url}: {e}")
@@ -299,6 +553,21 @@ def fetch_html_content(url: str) -> Optional[str]:
 def parse_date_flexible(date_str: Optional[str]) -> Optional[date]:
     if not date_str:
         return None
+    # The model occasionally returns a number or a list here; that only loses this field, not the document.
+    if not isinstance(date_str, str):
+        print(f"Warning: Could not parse date string: {date_str!r} (not a string)")
+        return None
+    return _parse_date_string(date_str)
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_date_string(date_str: str) -> Optional[date]:
+    # Nearly every date the model returns is in one of these shapes; dateparser is only needed for the rest.
+    for date_format in FAST_DATE_FORMATS:
+        try:
+            return datetime.strptime(date_str.strip(), date_format).date()
+        except ValueError:
+            pass
     try:
         dt_obj = parse(date_str)
         return dt_obj.date()
@@ -307,131 +576,175 @@ def parse_date_flexible(date_str: Optional[str]) -> Optional[date]:
         return None
 
 
-def extract_structured_data_via_ai(html_content: str, source_url: str) -> List[GreenData]:
-    if not OPENAI_KEY:
-        print(f"OpenAI API key not available. Skipping AI extraction for {source_url}.")
-        return []
-
-    client = openai.OpenAI(api_key=OPENAI_KEY)
-
-    tools = [
-        {
-            "type": "function",
-            "function": {
-                "name": "extract_coffee_data",
-                "description": "Extracts a list of green coffee bean details from HTML.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "coffees": {
-                            "type": "array",
-                            "description": "A list of coffee bean data objects found on the page.",
-                            "items": {
-                                "type": "object",
-                                "properties": {
-                                    "name": {"type": "string", "description": "Name of the coffee bean."},
-                                    "url": {"type": "string", "description": "Link to the coffee. "},
-                                    "farm": {"type": "string", "description": "Name of the farm or estate."},
-                                    "country": {"type": "string", "description": "Country of origin."},
-                                    "arrival": {"type": "string",
-                                                "description": "Arrival date or period (e.g., 'YYYY-MM-DD', 'June 2024', 'Fresh Crop')."},
-                                    "cupping_notes": {"type": "string", "description": "Tasting or cupping notes."},
-                                    "variety": {"type": "string", "description": "Coffee bean variety."},
-                                    "quantity_available": {
-                                        "type": "array",
-                                        "items": {
-                                            "type": "object",
-                                            "properties": {
-                                                "location": {"type": "string"},
-                                                "quantity_available": {"type": "integer"}
-                                            },
-                                            "required": []
-                                        }
-                                    },
-                                    "size": {
+SYSTEM_PROMPT_HTML = ("You are an expert data extraction assistant. "
+                      "Extract information about green coffee beans from the provided web page text using the available tool. "
+                      "If you are asked for a date, and if the string is a 'month year' or just a year, try your best to give a date, don't provide a string. "
+                      "If no coffee data is found, return an empty list of coffees. "
+                      "Only extract information explicitly present in the page text.")
+
+HTML_EXTRACTION_TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "extract_coffee_data",
+            "description": "Extracts a list of green coffee bean details from HTML.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "coffees": {
+                        "type": "array",
+                        "description": "A list of coffee bean data objects found on the page.",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "name": {"type": "string", "description": "Name of the coffee bean."},
+                                "url": {"type": "string", "description": "Link to the coffee. "},
+                                "farm": {"type": "string", "description": "Name of the farm or estate."},
+                                "country": {"type": "string", "description": "Country of origin."},
+                                "arrival": {"type": "string",
+                                            "description": "Arrival date or period (e.g., 'YYYY-MM-DD', 'June 2024', 'Fresh Crop')."},
+                                "cupping_notes": {"type": "string", "description": "Tasting or cupping notes."},
+                                "variety": {"type": "string", "description": "Coffee bean variety."},
+                                "quantity_available": {
+                                    "type": "array",
+                                    "items": {
                                         "type": "object",
                                         "properties": {
-                                            "units": {"type": "string"},
-                                            "value": {"type": "integer"}
-                                        }
-                                    },
-                                    "price": {
-                                        "type": "object",
-                                        "properties": {
-                                            "units": {"type": "string"},
-                                            "value": {"type": "number"}
-                                        }
+                                            "location": {"type": "string"},
+                                            "quantity_available": {"type": "integer"}
+                                        },
+                                        "required": []
                                     }
                                 },
-                                "required": ["name"]
-                            }
+                                "size": {
+                                    "type": "object",
+                                    "properties": {
+                                        "units": {"type": "string"},
+                                        "value": {"type": "integer"}
+                                    }
+                                },
+                                "price": {
+                                    "type": "object",
+                                    "properties": {
+                                        "units": {"type": "string"},
+                                        "value": {"type": "number"}
+                                    }
+                                }
+                            },
+                            "required": ["name"]
+                        }
+                    }
+                },
+                "required": ["coffees"]
+            }
+        }
+    }
+]
+
+
+SYSTEM_PROMPT_HTML_BATCH = (SYSTEM_PROMPT_HTML + " "
+                            "The text contains several documents, each introduced by a 'Document N' header. "
+                            "Report the coffees of each document under its document_id, and never mix coffees between documents.")
+
+BATCH_HTML_EXTRACTION_TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "extract_coffee_data_by_document",
+            "description": "Extracts green coffee bean details from several web pages, grouped by document.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "documents": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "document_id": {"type": "integer", "description": "The N of the 'Document N' header."},
+                                "coffees": HTML_EXTRACTION_TOOLS[0]["function"]["parameters"]["properties"]["coffees"],
+                            },
+                            "required": ["document_id", "coffees"]
                         }
-                    },
-                    "required": ["coffees"]
-                }
+                    }
+                },
+                "required": ["documents"]
             }
         }
-    ]
+    }
+]
+
+
+def green_data_from_ai_coffees(raw_coffees_data: List[Any]) -> List[GreenData]:
+    extracted_data_list: List[GreenData] = []
+
+    for coffee_dict in raw_coffees_data:
+        if not isinstance(coffee_dict, dict):
+            print(f"Warning: Expected dict for coffee item, got {type(coffee_dict)}. Skipping.")
+            continue
+
+        warehouse_data_list = []
+        raw_wh_data = coffee_dict.get('quantity_available', [])
+        if isinstance(raw_wh_data, list):
+            for wh_item in raw_wh_data:
+                if isinstance(wh_item, dict):
+                    warehouse_data_list.append(WarehouseData(**wh_item))
+
+        size_data = coffee_dict.get('size')
+        size_obj = Size(**size_data) if isinstance(size_data, dict) else None
+
+        price_data = coffee_dict.get('price')
+        price_obj = Price(**price_data) if isinstance(price_data, dict) else None
+
+        arrival_date_str = coffee_dict.get('arrival')
+        arrival_date_obj = parse_date_flexible(arrival_date_str)
+
+        green_data_item = GreenData(
+            name=coffee_dict.get('name'),
+            farm=coffee_dict.get('farm'),
+            country=coffee_dict.get('country'),
+            arrival=arrival_date_obj,
+            cupping_notes=coffee_dict.get('cupping_notes'),
+            variety=coffee_dict.get('variety'),
+            quantity_available=warehouse_data_list,
+            size=size_obj,
+            price=price_obj
+        )
+        extracted_data_list.append(green_data_item)
+
+    return extracted_data_list
+
+
+def extract_structured_data_via_ai(html_content: str, source_url: str) -> List[GreenData]:
+    if not OPENAI_KEY:
+        print(f"OpenAI API key not available. Skipping AI extraction for {source_url}.")
+        return []
+
+    # Error pages and bot walls would otherwise cost a full extraction call to return nothing.
+    if not COFFEE_RE.search(html_content):
+        print(f"No coffee-related text found on {source_url}. Skipping AI extraction.")
+        return []
+
+    client = CLIENT
 
     try:
         print(f"AI processing for {source_url}...")
-        response = client.chat.completions.create(
-            model="gpt-4o",  # Or another capable model like "gpt-4-turbo"
+        function_args_json = request_extraction_arguments(
+            client,
+            model=OPENAI_MODEL,
             messages=[
-                {"role": "system",
-                 "content": "You are an expert data extraction assistant. Extract information about green coffee beans from the provided HTML using the available tool. If you are asked for a date, and if the string is a 'month year' or just a year, try your best to give a date, don't provide a string. If no coffee data is found, return an empty list of coffees. Only extract information explicitly present in the HTML."},
+                {"role": "system", "content": SYSTEM_PROMPT_HTML},
                 {"role": "user",
-                 "content": f"Extract green coffee bean data from the following HTML content from {source_url}:\n\n{html_content[:100000]}"}
+                 "content": f"Extract green coffee bean data from the following page text from {source_url}:\n\n{truncate_to_token_budget(html_content)}"}
             ],
-            tools=tools,
-            tool_choice={"type": "function", "function": {"name": "extract_coffee_data"}},
-            temperature=0.2,
+            tools=HTML_EXTRACTION_TOOLS,
+            source_label=source_url,
         )
-
-        tool_calls = response.choices[0].message.tool_calls
-        if not tool_calls:
-            print(f"AI did not return any tool calls for {source_url}.")
+        if function_args_json is None:
             return []
 
-        function_args_json = tool_calls[0].function.arguments
         ai_output = json.loads(function_args_json)
 
-        extracted_data_list: List[GreenData] = []
-        raw_coffees_data = ai_output.get('coffees', [])
-
-        for coffee_dict in raw_coffees_data:
-            if not isinstance(coffee_dict, dict):
-                print(f"Warning: Expected dict for coffee item, got {type(coffee_dict)}. Skipping.")
-                continue
-
-            warehouse_data_list = []
-            raw_wh_data = coffee_dict.get('quantity_available', [])
-            if isinstance(raw_wh_data, list):
-                for wh_item in raw_wh_data:
-                    if isinstance(wh_item, dict):
-                        warehouse_data_list.append(WarehouseData(**wh_item))
-
-            size_data = coffee_dict.get('size')
-            size_obj = Size(**size_data) if isinstance(size_data, dict) else None
-
-            price_data = coffee_dict.get('price')
-            price_obj = Price(**price_data) if isinstance(price_data, dict) else None
-
-            arrival_date_str = coffee_dict.get('arrival')
-            arrival_date_obj = parse_date_flexible(arrival_date_str)
-
-            green_data_item = GreenData(
-                name=coffee_dict.get('name'),
-                farm=coffee_dict.get('farm'),
-                country=coffee_dict.get('country'),
-                arrival=arrival_date_obj,
-                cupping_notes=coffee_dict.get('cupping_notes'),
-                variety=coffee_dict.get('variety'),
-                quantity_available=warehouse_data_list,
-                size=size_obj,
-                price=price_obj
-            )
-            extracted_data_list.append(green_data_item)
+        extracted_data_list = green_data_from_ai_coffees(ai_output.get('coffees', []))
 
         print(f"AI extracted {len(extracted_data_list)} items for {source_url}.")
         return extracted_data_list
@@ -446,13 +759,95 @@ def extract_structured_data_via_ai(html_content: str, source_url: str) -> List[G
     return []
 
 
-class DataClassJSONEncoder(json.JSONEncoder):
-    def default(self, o: Any) -> Any:
-        if dataclasses.is_dataclass(o):
-            return dataclasses.asdict(o)
-        if isinstance(o, date):
-            return o.isoformat()
-        return super().default(o)
+def extract_structured_data_via_ai_batch(pages: List[Tuple[str, str]]) -> Dict[str, List[GreenData]]:
+    """
+    Extracts several small pages, given as (source_url, page_text), with a single API call and
+    returns the items found for each URL. A batch of one goes through extract_structured_data_via_ai.
+    """
+    if len(pages) == 1:
+        source_url, html_content = pages[0]
+        return {source_url: extract_structured_data_via_ai(html_content, source_url)}
+
+    results: Dict[str, List[GreenData]] = {source_url: [] for source_url, _ in pages}
+    if not OPENAI_KEY:
+        print(f"OpenAI API key not available. Skipping AI extraction for {len(pages)} pages.")
+        return results
+
+    coffee_pages = []
+    for source_url, html_content in pages:
+        if COFFEE_RE.search(html_content):
+            coffee_pages.append((source_url, html_content))
+        else:
+            print(f"No coffee-related text found on {source_url}. Skipping AI extraction.")
+    pages = coffee_pages
+    if not pages:
+        return results
+
+    source_label = ", ".join(source_url for source_url, _ in pages)
+    documents = "\n---\n".join(f"Document {document_id} (url={source_url}):\n{html_content}"
+                                for document_id, (source_url, html_content) in enumerate(pages, start=1))
+
+    try:
+        print(f"AI processing batch of {len(pages)} pages: {source_label}...")
+        function_args_json = request_extraction_arguments(
+            CLIENT,
+            model=OPENAI_MODEL,
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT_HTML_BATCH},
+                {"role": "user",
+                 "content": f"Extract green coffee bean data from each of the following documents:\n\n{documents}"}
+            ],
+            tools=BATCH_HTML_EXTRACTION_TOOLS,
+            source_label=source_label,
+        )
+        if function_args_json is None:
+            return results
+
+        ai_output = json.loads(function_args_json)
+        for document in ai_output.get('documents', []):
+            document_id = document.get('document_id') if isinstance(document, dict) else None
+            if not isinstance(document_id, int) or not 1 <= document_id <= len(pages):
+                print(f"Warning: AI returned an unknown document id {document_id!r} for batch {source_label}. Skipping.")
+                continue
+            source_url = pages[document_id - 1][0]
+            results[source_url].extend(green_data_from_ai_coffees(document.get('coffees', [])))
+
+        for source_url, _ in pages:
+            print(f"AI extracted {len(results[source_url])} items for {source_url}.")
+
+    except openai.APIError as e:
+        print(f"OpenAI API error for batch {source_label}: {e}")
+    except json.JSONDecodeError as e:
+        print(f"Failed to parse JSON response from AI for batch {source_label}: {e}")
+    except Exception as e:
+        print(f"An unexpected error occurred during AI extraction for batch {source_label}: {e}")
+
+    return results
+
+
+def batch_pages_for_extraction(pages: List[Tuple[str, str]]) -> List[List[Tuple[str, str]]]:
+    """
+    Groups short pages into shared batches and leaves long pages on their own. A batch is sized by
+    the UTF-8 byte length of its pages, which bounds their token count from above (as in
+    truncate_to_token_budget), so a batch always fits MAX_DOCUMENT_TOKENS.
+    """
+    batches: List[List[Tuple[str, str]]] = []
+    current_batch: List[Tuple[str, str]] = []
+    current_size = 0
+    for source_url, html_content in pages:
+        page_size = len(html_content.encode())
+        if len(html_content) > SMALL_DOCUMENT_CHARS or page_size > MAX_DOCUMENT_TOKENS:
+            batches.append([(source_url, html_content)])
+            continue
+        if current_batch and (len(current_batch) >= MAX_BATCH_DOCUMENTS
+                              or current_size + page_size > MAX_DOCUMENT_TOKENS):
+            batches.append(current_batch)
+            current_batch, current_size = [], 0
+        current_batch.append((source_url, html_content))
+        current_size += page_size
+    if current_batch:
+        batches.append(current_batch)
+    return batches
 
 
 def main():
@@ -469,24 +864,58 @@ def main():
         print("Invalid choice. Please enter 'sites' or 'pdfs'.")
 
     if scrape_choice == 'sites':
+        # Page fetches are almost all network wait, so run them concurrently on a small pool.
+        print(f"Fetching {len(URL_LIST)} URLs...")
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_FETCHES) as executor:
+            html_by_url = dict(zip(URL_LIST, executor.map(fetch_html_content, URL_LIST)))
+
+        # Pages whose body hasn't changed since the last run reuse the items extracted then.
+        processed_html_hashes = load_processed_html_hashes()
+        html_hashes_updated = False
+        page_hashes = {item_url: hashlib.sha256(html.encode()).hexdigest()
+                       for item_url, html in html_by_url.items() if html}
+
+        changed_pages = [(item_url, html_by_url[item_url]) for item_url, page_hash in page_hashes.items()
+                         if processed_html_hashes.get(item_url, {}).get("hash") != page_hash]
+
+        # AI extraction is mostly waiting on the API as well; a smaller pool keeps us under rate limits.
+        # Short pages are batched together so they share one request's overhead.
+        extractions = {}  # item_url -> future of its batch's {url: items}
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_AI_REQUESTS) as executor:
+            for batch in batch_pages_for_extraction(changed_pages):
+                batch_extraction = executor.submit(extract_structured_data_via_ai_batch, batch)
+                for item_url, _ in batch:
+                    extractions[item_url] = batch_extraction
+
         for item_url in URL_LIST:
             print(f"Processing URL: {item_url}")
-            html = fetch_html_content(item_url)
-            if html:
+            extraction = extractions.get(item_url)
+            if extraction:
                 try:
-                    data_items = extract_structured_data_via_ai(html, item_url)
+                    data_items = extraction.result()[item_url]
                     for item in data_items:
                         if item.added is None:
                             item.added = current_date
                         if item.url is None:  # Ensure URL from scraping is set
                             item.url = item_url
                     source_data_map[item_url] = data_items
+                    if data_items:
+                        processed_html_hashes[item_url] = {"hash": page_hashes[item_url], "items": data_items}
+                        html_hashes_updated = True
                 except Exception as e:
                     print(f"Error during AI processing for {item_url}: {e}")
                     source_data_map[item_url] = []
+            elif item_url in page_hashes:
+                print(f"Skipping AI for {item_url} as its content is unchanged (hash: {page_hashes[item_url][:8]}...).")
+                source_data_map[item_url] = [green_data_from_dict(item)
+                                             for item in processed_html_hashes[item_url]["items"]]
             else:
                 source_data_map[item_url] = []
 
+        if html_hashes_updated:
+            save_processed_html_hashes(processed_html_hashes)
+            print(f"Updated processed HTML hashes in {HTML_HASH_FILE}")
+
     elif scrape_choice == 'pdfs':
         pdf_folder_path = "offer_pdfs"
         if not os.path.isdir(pdf_folder_path):
@@ -496,40 +925,51 @@ def main():
         processed_hashes = load_processed_pdf_hashes()
         new_hashes_this_session = set()
 
-        for filename in os.listdir(pdf_folder_path):
-            if filename.lower().endswith(".pdf"):
-                pdf_path = os.path.join(pdf_folder_path, filename)
-                print(f"Processing PDF: {pdf_path}")
+        pdf_paths = [os.path.join(pdf_folder_path, filename) for filename in os.listdir(pdf_folder_path)
+                     if filename.lower().endswith(".pdf")]
 
-                file_hash = calculate_file_hash(pdf_path)
+        # Hashing and text extraction are CPU-bound and independent per file, so spread them across cores.
+        pending_pdfs = []  # (filename, pdf_path, file_hash, pdf_text) still needing AI extraction
+        with ProcessPoolExecutor() as executor:
+            unprocessed = []  # (pdf_path, file_hash)
+            for pdf_path, file_hash in zip(pdf_paths, calculate_pdf_hashes(pdf_paths, executor)):
+                print(f"Processing PDF: {pdf_path}")
                 if not file_hash:
                     continue
 
                 if file_hash in processed_hashes:
-                    print(f"Skipping {filename} as it has already been processed (hash: {file_hash[:8]}...).")
+                    print(f"Skipping {os.path.basename(pdf_path)} as it has already been processed (hash: {file_hash[:8]}...).")
                     continue
 
-                pdf_text = extract_text_from_pdf(pdf_path)
+                source_data_map[pdf_path] = []
+                unprocessed.append((pdf_path, file_hash))
+
+            pdf_texts = extract_texts_from_pdfs([pdf_path for pdf_path, _ in unprocessed], executor)
+            for (pdf_path, file_hash), pdf_text in zip(unprocessed, pdf_texts):
                 if pdf_text:
-                    try:
-                        data_items = extract_structured_data_from_pdf_text_via_ai(pdf_text, filename)
-                        for item in data_items:
-                            if item.added is None:
-                                item.added = current_date
-                            if item.url is None:
-                                item.url = pdf_path
-                        source_data_map[pdf_path] = data_items
-                        if data_items:
-                            new_hashes_this_session.add(file_hash)
-                    except Exception as e:
-                        print(f"Error during AI processing for PDF {filename}: {e}")
-                        source_data_map[pdf_path] = []
-                else:
-                    source_data_map[pdf_path] = []
+                    pending_pdfs.append((os.path.basename(pdf_path), pdf_path, file_hash, pdf_text))
+
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_AI_REQUESTS) as executor:
+            extractions = [executor.submit(extract_structured_data_from_pdf_text_via_ai, pdf_text, filename)
+                           for filename, _, _, pdf_text in pending_pdfs]
+
+        for (filename, pdf_path, file_hash, _), extraction in zip(pending_pdfs, extractions):
+            try:
+                data_items = extraction.result()
+                for item in data_items:
+                    if item.added is None:
+                        item.added = current_date
+                    if item.url is None:
+                        item.url = pdf_path
+                source_data_map[pdf_path] = data_items
+                if data_items:
+                    new_hashes_this_session.add(file_hash)
+            except Exception as e:
+                print(f"Error during AI processing for PDF {filename}: {e}")
+                source_data_map[pdf_path] = []
 
         if new_hashes_this_session:
-            updated_hashes = processed_hashes.union(new_hashes_this_session)
-            save_processed_pdf_hashes(updated_hashes)
+            append_processed_pdf_hashes(new_hashes_this_session)
             print(f"Updated processed PDF hashes in {PDF_HASH_FILE}")
 
     filename_date_stamp = datetime.now().strftime("%Y%m%d")
@@ -537,8 +977,9 @@ def main():
     json_output_path = os.path.join(output_data_folder,
                                     f"daily_coffee_data_{scrape_type_suffix}_{filename_date_stamp}.json")
 
-    with open(json_output_path, 'w') as json_file:
-        json.dump(source_data_map, json_file, cls=DataClassJSONEncoder, indent=4)
+    # orjson serializes the dataclasses and dates natively; compact output since this file is machine-read.
+    with open(json_output_path, 'wb') as json_file:
+        json_file.write(orjson.dumps(source_data_map))
 
     print(f"Structured data saved to {json_output_path}")
 
@@ -1,8 +1,19 @@
+import functools
 import os
+import pickle
 import re
+import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote
 
+import numpy as np
+import orjson
+import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -13,11 +24,44 @@ SHOPIFY_ADMIN_API_ACCESS_TOKEN = os.getenv("SHOPIFY_ADMIN_API_ACCESS_TOKEN")
 SHOPIFY_API_VERSION = os.getenv("SHOPIFY_API_VERSION", "2024-01")
 
 USER_SKIP_COMMAND = "skip"
+BULK_OPERATION_POLL_SECONDS = 2
+SHOPIFY_CACHE_DIR = ".ceto_cache"
+SHOPIFY_CACHE_TTL_SECONDS = 15 * 60
+LATEST_BATCH_ORDER_FIELDS = "id,line_items,fulfillments"
+LATEST_BATCH_LOOKBACK_DAYS = 7
+LATEST_BATCH_MAX_LOOKBACK_DAYS = 365
+MAX_CONCURRENT_SHOPIFY_REQUESTS = 4  # Shopify's REST leaky bucket refills at 2 requests/second
 
 LBS_TO_GRAMS_CONVERSION = 453.59237
 ROAST_LOSS_PERCENTAGE = 0.15
 ROAST_YIELD_FACTOR = 1.0 - ROAST_LOSS_PERCENTAGE
 
+# Shared by every Shopify call so pagination and bulk-operation polling reuse one keep-alive connection;
+# rate-limited (429) and transient 5xx responses are retried with backoff.
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=8,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]),
+))
+
+_NEXT_LINK_RE = re.compile(r'<([^>]+)>\s*;\s*rel="next"')
+
+# One pass over the title for every unit. kg/lb/oz spellings need a word boundary after them, while grams
+# only need no letter to follow (so "250g2" still counts as grams).
+_WEIGHT_RE = re.compile(r'(?P<value>\d+\.?\d*)\s*(?:(?P<unit>kg|kilograms?|lbs?|pounds?|oz|ounces?)\b|(?P<gram_unit>g|grams?)(?![a-zA-Z]))')
+# spelling -> (priority, grams per unit, unit type); when a title mentions several units the lowest priority wins.
+_WEIGHT_UNITS = {
+    'kg': (0, 1000, 'kg'), 'kilogram': (0, 1000, 'kg'), 'kilograms': (0, 1000, 'kg'),
+    'lb': (1, 453.59237, 'lb'), 'lbs': (1, 453.59237, 'lb'), 'pound': (1, 453.59237, 'lb'), 'pounds': (1, 453.59237, 'lb'),
+    'oz': (2, 28.3495, 'oz'), 'ounce': (2, 28.3495, 'oz'), 'ounces': (2, 28.3495, 'oz'),
+    'g': (3, 1, 'g'), 'gram': (3, 1, 'g'), 'grams': (3, 1, 'g'),
+}
+# Every weight starts with a digit; most variant titles ("Default Title", "Whole Bean") have none.
+_HAS_DIGIT = re.compile(r'\d').search
+# Every unit spelling in _WEIGHT_UNITS contains one of these, so titles without any of them can't carry a weight.
+_WEIGHT_UNIT_HINTS = ('g', 'lb', 'pound', 'oz', 'ounce')
+
 
 def get_shopify_headers():
     if not SHOPIFY_ADMIN_API_ACCESS_TOKEN:
@@ -34,207 +78,354 @@ def build_shopify_url(endpoint):
     return f"https://{SHOPIFY_STORE_NAME}.myshopify.com/admin/api/{SHOPIFY_API_VERSION}/{endpoint}"
 
 
+@functools.lru_cache(maxsize=256)
 def parse_weight_from_title(title_string):
     """
     Attempts to parse weight in grams from a string (e.g., variant title).
     Returns (grams, unit_type_parsed) or (None, None) if not found.
     Unit types: 'g', 'kg', 'lb', 'oz'.
     """
-    if not title_string:
+    if not title_string or not _HAS_DIGIT(title_string):
         return None, None
     title_lower = title_string.lower()
+    if not any(hint in title_lower for hint in _WEIGHT_UNIT_HINTS):
+        return None, None
 
-    match_kg = re.search(r'(\d+\.?\d*)\s*(?:kg|kilogram|kilograms)\b', title_lower)
-    if match_kg:
-        try:
-            return float(match_kg.group(1)) * 1000, 'kg'
-        except ValueError:
-            pass
+    best = None  # (priority, value, grams per unit, unit type)
+    for match in _WEIGHT_RE.finditer(title_lower):
+        # The unit group is always the last one to close, so lastgroup names whichever spelling matched.
+        priority, grams_per_unit, unit = _WEIGHT_UNITS[match[match.lastgroup]]
+        if best is None or priority < best[0]:
+            best = (priority, match['value'], grams_per_unit, unit)
+            if priority == 0:
+                break
+    if best:
+        _, value, grams_per_unit, unit = best
+        return float(value) * grams_per_unit, unit
 
-    match_lb = re.search(r'(\d+\.?\d*)\s*(?:lb|lbs|pound|pounds)\b', title_lower)
-    if match_lb:
-        try:
-            return float(match_lb.group(1)) * 453.59237, 'lb'
-        except ValueError:
-            pass
+    return None, None
 
-    match_oz = re.search(r'(\d+\.?\d*)\s*(?:oz|ounce|ounces)\b', title_lower)
-    if match_oz:
-        try:
-            return float(match_oz.group(1)) * 28.3495, 'oz'
-        except ValueError:
-            pass
+PRODUCTS_BULK_QUERY = """
+{
+  products {
+    edges {
+      node {
+        id
+        title
+        variants {
+          edges {
+            node {
+              id
+              title
+              sku
+              inventoryQuantity
+              inventoryPolicy
+            }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+OPEN_ORDER_LINE_ITEMS_BULK_QUERY = """
+{
+  orders(query: "status:open") {
+    edges {
+      node {
+        id
+        lineItems {
+          edges {
+            node {
+              variant {
+                id
+              }
+              fulfillableQuantity
+            }
+          }
+        }
+      }
+    }
+  }
+}
+"""
 
-    match_g = re.search(r'(\d+\.?\d*)\s*(?:g|gram|grams)(?![a-zA-Z])', title_lower)
-    if match_g:
-        try:
-            return float(match_g.group(1)), 'g'
-        except ValueError:
-            pass
 
-    return None, None
+def shopify_graphql(query, variables=None):
+    """Runs a GraphQL Admin API request and returns its `data`, raising ValueError on GraphQL errors."""
+    response = _SESSION.post(build_shopify_url("graphql.json"), headers=get_shopify_headers(),
+                             json={"query": query, "variables": variables or {}})
+    response.raise_for_status()
+    payload = orjson.loads(response.content)
+    if payload.get("errors"):
+        raise ValueError(f"GraphQL errors: {payload['errors']}")
+    return payload["data"]
+
+
+def iter_bulk_query_rows(query):
+    """
+    Runs `query` as a Shopify bulk operation and yields the rows of its JSONL result as they download.
+    The whole connection is exported server-side, so this is a handful of requests however large the
+    store is. Rows of nested connections carry the parent's GraphQL id in `__parentId`.
+    """
+    data = shopify_graphql(
+        """
+        mutation RunBulkQuery($query: String!) {
+          bulkOperationRunQuery(query: $query) {
+            bulkOperation { id }
+            userErrors { field message }
+          }
+        }
+        """,
+        {"query": query},
+    )
+    user_errors = data["bulkOperationRunQuery"]["userErrors"]
+    if user_errors:
+        raise ValueError(f"Bulk operation rejected: {user_errors}")
+
+    while True:
+        operation = shopify_graphql("{ currentBulkOperation { id status errorCode url } }")["currentBulkOperation"]
+        if operation["status"] == "COMPLETED":
+            break
+        if operation["status"] in ("FAILED", "CANCELED", "EXPIRED"):
+            raise ValueError(f"Bulk operation {operation['id']} {operation['status'].lower()}: {operation['errorCode']}")
+        time.sleep(BULK_OPERATION_POLL_SECONDS)
+
+    if not operation["url"]:  # the query matched nothing
+        return
+    # The result URL is pre-signed; it must not be sent the Shopify access token.
+    with requests.get(operation["url"], stream=True) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if line:
+                yield orjson.loads(line)
+
+
+def run_bulk_query(query):
+    """Returns every row of iter_bulk_query_rows(query)."""
+    return list(iter_bulk_query_rows(query))
+
+
+def cached_shopify_fetch(name, fetch, *args):
+    """
+    Returns fetch(*args), reusing the result pickled under SHOPIFY_CACHE_DIR if it is younger than
+    SHOPIFY_CACHE_TTL_SECONDS, so re-running the planner doesn't re-export the whole store each time.
+    The cache is per store and API version; delete the directory to force a refresh.
+    """
+    cache_path = os.path.join(SHOPIFY_CACHE_DIR, f"{SHOPIFY_STORE_NAME}-{SHOPIFY_API_VERSION}-{name}.pickle")
+    try:
+        if time.time() - os.path.getmtime(cache_path) < SHOPIFY_CACHE_TTL_SECONDS:
+            with open(cache_path, "rb") as f:
+                return pickle.load(f)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Ignoring unreadable Shopify cache {cache_path}: {e}")
+
+    result = fetch(*args)
+    try:
+        os.makedirs(SHOPIFY_CACHE_DIR, exist_ok=True)
+        with open(cache_path, "wb") as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError as e:
+        print(f"Could not write Shopify cache {cache_path}: {e}")
+    return result
+
+
+def gid_to_id(gid):
+    """'gid://shopify/ProductVariant/123' -> 123, matching the numeric ids the REST API returns."""
+    return int(gid.rsplit("/", 1)[-1])
+
 
 def fetch_and_structure_products():
     structured_products = {}
-    endpoint = "products.json?limit=250&fields=id,title,variants"
-    headers = get_shopify_headers()
-    page_count = 0
-    while endpoint:
-        page_count += 1
-        relative_endpoint = endpoint.split(f'/admin/api/{SHOPIFY_API_VERSION}/')[-1]
-        url = build_shopify_url(relative_endpoint)
-        try:
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
-            data = response.json()
-            products_on_page = data.get("products", [])
-            if not products_on_page: break
-            for product_data in products_on_page:
-                product_id = product_data['id']
-                product_title = product_data['title']
-                variants_dict = {}
-                for variant_data in product_data.get("variants", []):
-                    grams, unit = parse_weight_from_title(variant_data['title'])
-                    variants_dict[variant_data['id']] = {
-                        'variant_id': variant_data['id'],
-                        'variant_title': variant_data['title'],
-                        'sku': variant_data.get('sku', 'N/A'),
-                        'grams_per_item': grams,
-                        'parsed_unit_type': unit,
-                        'inventory_quantity': variant_data.get('inventory_quantity', 0),
-                        'inventory_policy': variant_data.get('inventory_policy', 'deny')
-                    }
-                structured_products[product_id] = {
-                    'product_id': product_id,
-                    'product_title': product_title,
-                    'variants': variants_dict
-                }
-            link_header = response.headers.get("Link")
-            endpoint = None
-            if link_header:
-                links = link_header.split(',')
-                for link in links:
-                    parts = link.split(';')
-                    if 'rel="next"' in parts[1]:
-                        next_url = parts[0].strip()[1:-1]
-                        endpoint = next_url.split(f'/admin/api/{SHOPIFY_API_VERSION}/')[-1]
-                        break
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching products: {e}")
-            if hasattr(e, 'response') and e.response is not None: print(f"Response content: {e.response.text}")
-            return None
-        except ValueError as e:
-            print(f"Error decoding JSON for products: {e}")
-            return None
+    try:
+        rows = cached_shopify_fetch("products", run_bulk_query, PRODUCTS_BULK_QUERY)
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching products: {e}")
+        if hasattr(e, 'response') and e.response is not None: print(f"Response content: {e.response.text}")
+        return None
+    except ValueError as e:
+        print(f"Error reading products: {e}")
+        return None
+
+    for row in rows:
+        if "__parentId" not in row:
+            product_id = gid_to_id(row['id'])
+            structured_products[product_id] = {
+                'product_id': product_id,
+                'product_title': row['title'],
+                'variants': {}
+            }
+    for row in rows:
+        if "__parentId" not in row:
+            continue
+        variant_id = gid_to_id(row['id'])
+        grams, unit = parse_weight_from_title(row['title'])
+        structured_products[gid_to_id(row['__parentId'])]['variants'][variant_id] = {
+            'variant_id': variant_id,
+            'variant_title': row['title'],
+            'sku': row.get('sku', 'N/A'),
+            'grams_per_item': grams,
+            'parsed_unit_type': unit,
+            'inventory_quantity': row.get('inventoryQuantity') or 0,
+            'inventory_policy': (row.get('inventoryPolicy') or 'deny').lower()
+        }
     return structured_products
 
 
+def products_to_table(structured_products):
+    """Flattens structured_products into one row per variant, so per-product figures are column aggregations."""
+    rows = [
+        (product_id, product_info['product_title'], variant['variant_id'], variant['variant_title'], variant['sku'],
+         variant['grams_per_item'], variant['parsed_unit_type'], variant['inventory_quantity'], variant['inventory_policy'])
+        for product_id, product_info in structured_products.items()
+        for variant in product_info['variants'].values()
+    ]
+    return pd.DataFrame(rows, columns=['product_id', 'product_title', 'variant_id', 'variant_title', 'sku',
+                                       'grams_per_item', 'parsed_unit_type', 'inventory_quantity', 'inventory_policy'])
+
+
 def fetch_unfulfilled_order_quantities(all_variant_ids):
     unfulfilled_quantities = defaultdict(int)
-    endpoint = "orders.json?status=open&limit=250&fields=id,line_items"
-    headers = get_shopify_headers()
-    page_count = 0
-    while endpoint:
-        page_count += 1
-        relative_endpoint = endpoint.split(f'/admin/api/{SHOPIFY_API_VERSION}/')[-1]
-        url = build_shopify_url(relative_endpoint)
-        try:
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
-            data = response.json()
-            orders_on_page = data.get("orders", [])
-            if not orders_on_page: break
-            for order in orders_on_page:
-                for item in order.get("line_items", []):
-                    variant_id = item.get("variant_id")
-                    fulfillable_quantity = item.get("fulfillable_quantity", 0)
-                    if variant_id and variant_id in all_variant_ids and fulfillable_quantity > 0:
-                        unfulfilled_quantities[variant_id] += fulfillable_quantity
-            link_header = response.headers.get("Link")
-            endpoint = None
-            if link_header:
-                links = link_header.split(',')
-                for link in links:
-                    parts = link.split(';')
-                    if 'rel="next"' in parts[1]:
-                        next_url = parts[0].strip()[1:-1]
-                        endpoint = next_url.split(f'/admin/api/{SHOPIFY_API_VERSION}/')[-1]
-                        break
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching orders: {e}")
-            if hasattr(e, 'response') and e.response is not None: print(f"Response content: {e.response.text}")
-            return None
-        except ValueError as e:
-            print(f"Error decoding JSON for orders: {e}")
-            return None
+    try:
+        rows = cached_shopify_fetch("open-orders", run_bulk_query, OPEN_ORDER_LINE_ITEMS_BULK_QUERY)
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching orders: {e}")
+        if hasattr(e, 'response') and e.response is not None: print(f"Response content: {e.response.text}")
+        return None
+    except ValueError as e:
+        print(f"Error reading orders: {e}")
+        return None
+
+    for row in rows:
+        if "__parentId" not in row or not row.get("variant"):
+            continue  # order rows, and line items whose variant was deleted
+        variant_id = gid_to_id(row["variant"]["id"])
+        fulfillable_quantity = row.get("fulfillableQuantity", 0)
+        if variant_id in all_variant_ids and fulfillable_quantity > 0:
+            unfulfilled_quantities[variant_id] += fulfillable_quantity
     return unfulfilled_quantities
 
 
+def next_page_endpoint(response):
+    """Returns the relative endpoint of the rel="next" page from a REST response's Link header, if any."""
+    match = _NEXT_LINK_RE.search(response.headers.get("Link") or "")
+    if match:
+        return match.group(1).split(f"/admin/api/{SHOPIFY_API_VERSION}/")[-1]
+    return None
+
+
+def fetch_order_pages(endpoint, headers, keep=None):
+    """
+    Follows REST cursor pagination from `endpoint` and returns the orders from every page. If `keep` is
+    given, only orders for which it returns a truthy value are retained; the rest of each page is dropped
+    as soon as it has been parsed.
+    """
+    orders = []
+    while endpoint:
+        response = _SESSION.get(build_shopify_url(endpoint), headers=headers)
+        response.raise_for_status()
+        orders_on_page = orjson.loads(response.content).get("orders", [])
+        if not orders_on_page:
+            break
+        orders.extend(orders_on_page if keep is None else filter(keep, orders_on_page))
+        endpoint = next_page_endpoint(response)
+    return orders
+
+
+def fetch_all_orders_concurrently(fields, headers, keep=None):
+    """
+    REST pagination is cursor-based, so one walk over the order history is strictly sequential.
+    Instead, split the history into equal created_at windows and walk those in parallel. The history
+    starts at the lowest-id order (since_id=0 returns orders in ascending id order).
+    """
+    response = _SESSION.get(
+        build_shopify_url("orders.json?status=any&limit=1&since_id=0&fields=created_at"),
+        headers=headers)
+    response.raise_for_status()
+    oldest_orders = orjson.loads(response.content).get("orders", [])
+    if not oldest_orders:
+        return []
+
+    start = datetime.fromisoformat(oldest_orders[0]["created_at"])
+    window = (datetime.now(timezone.utc) - start) / MAX_CONCURRENT_SHOPIFY_REQUESTS
+    # The first and last windows are open-ended, so no order is missed even if `start` isn't the true minimum.
+    endpoints = [
+        f"orders.json?status=any&limit=250&fields={fields}"
+        + (f"&created_at_min={quote((start + window * i).isoformat())}" if i > 0 else "")
+        + (f"&created_at_max={quote((start + window * (i + 1)).isoformat())}"
+           if i < MAX_CONCURRENT_SHOPIFY_REQUESTS - 1 else "")
+        for i in range(MAX_CONCURRENT_SHOPIFY_REQUESTS)
+    ]
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_SHOPIFY_REQUESTS) as executor:
+        pages = executor.map(lambda endpoint: fetch_order_pages(endpoint, headers, keep), endpoints)
+        # Window bounds are inclusive, so an order created exactly on a boundary can appear twice.
+        orders_by_id = {order["id"]: order for orders in pages for order in orders}
+    return list(orders_by_id.values())
+
+
+def first_fulfillment_date(order):
+    fulfillments = order.get("fulfillments") or []
+    created_at = fulfillments[0].get("created_at") if fulfillments else None
+    return created_at[:10] if created_at else None
+
+
+def latest_fulfillment_batch(orders):
+    """Returns the orders whose first fulfillment falls on the latest fulfillment date among `orders`."""
+    dated_orders = [(first_fulfillment_date(order), order) for order in orders]
+    latest_date = max((date_key for date_key, _ in dated_orders if date_key), default=None)
+    return [order for date_key, order in dated_orders if latest_date and date_key == latest_date]
+
+
+def fetch_latest_fulfilled_batch_orders(headers):
+    """
+    Fetches only recently updated orders instead of the whole history. Fulfilling an order bumps its
+    updated_at, so every order in the latest fulfillment batch was updated on or after the start of
+    that batch's date: once the window reaches back past it, the batch is complete. Otherwise the
+    window is widened, falling back to a full history scan past LATEST_BATCH_MAX_LOOKBACK_DAYS.
+    """
+    lookback_days = LATEST_BATCH_LOOKBACK_DAYS
+    while lookback_days <= LATEST_BATCH_MAX_LOOKBACK_DAYS:
+        since = datetime.now(timezone.utc) - timedelta(days=lookback_days)
+        orders = fetch_order_pages(
+            f"orders.json?status=any&limit=250&fields={LATEST_BATCH_ORDER_FIELDS}"
+            f"&updated_at_min={quote(since.isoformat())}", headers, keep=first_fulfillment_date)
+        batch = latest_fulfillment_batch(orders)
+        if batch:
+            fulfilled_at = datetime.fromisoformat(batch[0]["fulfillments"][0]["created_at"])
+            if fulfilled_at.replace(hour=0, minute=0, second=0, microsecond=0) >= since:
+                return batch
+        lookback_days *= 4
+    return latest_fulfillment_batch(
+        fetch_all_orders_concurrently(LATEST_BATCH_ORDER_FIELDS, headers, keep=first_fulfillment_date))
+
+
 def fetch_latest_fulfilled_batch_quantities(all_variant_ids):
     """If no open orders are found, return quantities from the most recent
     fulfillment batch. All orders that share the same fulfillment date are
     aggregated together."""
 
     batch_quantities = defaultdict(int)
-    endpoint = (
-        "orders.json?status=any&limit=250&fields=id,line_items,fulfillments"
-    )
     headers = get_shopify_headers()
-    fulfillments_by_date = defaultdict(list)
 
-    while endpoint:
-        relative_endpoint = endpoint.split(
-            f"/admin/api/{SHOPIFY_API_VERSION}/"
-        )[-1]
-        url = build_shopify_url(relative_endpoint)
-        try:
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
-            data = response.json()
-            orders_on_page = data.get("orders", [])
-            if not orders_on_page:
-                break
-            for order in orders_on_page:
-                fulfillments = order.get("fulfillments", [])
-                if not fulfillments:
-                    continue
-                created_at = fulfillments[0].get("created_at")
-                if not created_at:
-                    continue
-                date_key = created_at[:10]
-                fulfillments_by_date[date_key].append(order)
-
-            link_header = response.headers.get("Link")
-            endpoint = None
-            if link_header:
-                links = link_header.split(',')
-                for link in links:
-                    parts = link.split(';')
-                    if 'rel="next"' in parts[1]:
-                        next_url = parts[0].strip()[1:-1]
-                        endpoint = next_url.split(
-                            f"/admin/api/{SHOPIFY_API_VERSION}/"
-                        )[-1]
-                        break
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching fulfilled orders: {e}")
-            if hasattr(e, 'response') and e.response is not None:
-                print(f"Response content: {e.response.text}")
-            return None
-        except ValueError as e:
-            print(f"Error decoding JSON for fulfilled orders: {e}")
-            return None
-
-    if not fulfillments_by_date:
-        return batch_quantities
-
-    latest_date = max(fulfillments_by_date.keys())
-
-    for order in fulfillments_by_date[latest_date]:
+    try:
+        batch_orders = cached_shopify_fetch("latest-fulfilled-batch", fetch_latest_fulfilled_batch_orders, headers)
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching fulfilled orders: {e}")
+        if hasattr(e, 'response') and e.response is not None:
+            print(f"Response content: {e.response.text}")
+        return None
+    except ValueError as e:
+        print(f"Error decoding JSON for fulfilled orders: {e}")
+        return None
+
+    for order in batch_orders:
         for item in order.get("line_items", []):
             variant_id = item.get("variant_id")
             qty = item.get("quantity", 0)
-            if variant_id and variant_id in all_variant_ids and qty > 0:
+            if variant_id in all_variant_ids and qty > 0:  # None (deleted variant) is never in the set
                 batch_quantities[variant_id] += qty
 
     return batch_quantities
@@ -285,7 +476,8 @@ if __name__ == "__main__":
         print("Could not retrieve product data. Exiting.")
         exit()
 
-    all_variant_ids_from_products = {vid for pid in all_products_data for vid in all_products_data[pid]['variants']}
+    all_variant_ids_from_products = frozenset(
+        vid for product_info in all_products_data.values() for vid in product_info['variants'])
     if not all_variant_ids_from_products:
         print("No variants found. Exiting.")
         exit()
@@ -308,20 +500,17 @@ if __name__ == "__main__":
 
     roast_plan_data = {}
 
+    # Only products with open demand or any variant in stock need planning.
+    variants_df = products_to_table(all_products_data)
+    variants_df['unfulfilled'] = variants_df['variant_id'].map(shopify_unfulfilled_quantities).fillna(0)
+    variants_df['in_stock'] = variants_df['inventory_quantity'] > 0
+    product_demand = variants_df.groupby('product_id').agg(unfulfilled=('unfulfilled', 'sum'), in_stock=('in_stock', 'any'))
+    products_to_plan = set(product_demand.index[(product_demand['unfulfilled'] > 0) | product_demand['in_stock']])
+
     for product_id, product_info in all_products_data.items():
         product_title = product_info['product_title']
 
-        total_unfulfilled_for_product = 0
-        all_variants_out_of_stock = True
-        if not product_info['variants']:
-            all_variants_out_of_stock = True
-        else:
-            for variant_id, variant_details in product_info['variants'].items():
-                total_unfulfilled_for_product += shopify_unfulfilled_quantities.get(variant_id, 0)
-                if variant_details.get('inventory_quantity', 0) > 0:
-                    all_variants_out_of_stock = False
-
-        if total_unfulfilled_for_product == 0 and all_variants_out_of_stock:
+        if product_id not in products_to_plan:
             continue
 
         current_product_roast_details = {
@@ -386,31 +575,37 @@ if __name__ == "__main__":
 
     print("\n\nProduct\tRoasted Needed")
 
-    total_bags = 0
-
     if not roast_plan_data:
         print("No products were selected or had demand for roasting.")
     else:
-        for product_id, data in roast_plan_data.items():
+        # Flatten every variant into parallel arrays so the totals are a few vectorized passes.
+        product_rows = list(roast_plan_data.values())
+        variant_rows = [(product_idx, v_data) for product_idx, data in enumerate(product_rows)
+                        for v_data in data['variant_needs'].values()]
+        product_idx = np.array([idx for idx, _ in variant_rows], dtype=np.intp)
+        grams = np.array([v_data['grams_per_item'] or 0.0 for _, v_data in variant_rows], dtype=float)
+        units = np.array([v_data['shopify_order_qty'] + v_data['sample_qty_units'] + v_data['cafe_qty_units']
+                          for _, v_data in variant_rows], dtype=np.int64)
+        has_weight = grams > 0
+
+        # add some buffer as we always put in at least five extra grams on average, and toss some away
+        roasted = np.where(has_weight & (units > 0), units * grams + 8, 0.0)
+        totals = np.bincount(product_idx, weights=roasted, minlength=len(product_rows))
+        total_bags = int(units[has_weight & (grams > 50)].sum())
+        # Only warn if there were quantities but no weight
+        missing_weight = ~has_weight & (units > 0)
+
+        missing_weight_titles = defaultdict(list)
+        for (idx, v_data), missing in zip(variant_rows, missing_weight):
+            if missing:
+                missing_weight_titles[idx].append(v_data['variant_title'])
+
+        for idx, (data, total_roasted_grams_for_product) in enumerate(zip(product_rows, totals.tolist())):
             product_title = data['product_title']
-            total_roasted_grams_for_product = 0.0
-
-            for v_id, v_data in data['variant_needs'].items():
-                grams_per_item = v_data['grams_per_item']
-                if grams_per_item and grams_per_item > 0:
-                    total_units = v_data['shopify_order_qty'] + v_data['sample_qty_units'] + v_data['cafe_qty_units']
-                    if grams_per_item > 50:
-                        total_bags += total_units
-                    # add some buffer as we always put in at least five extra grams on average, and toss some away
-                    if total_units:
-                        total_roasted_grams_for_product += total_units * grams_per_item + 8
-                elif v_data['shopify_order_qty'] > 0 or v_data['sample_qty_units'] > 0 or v_data['cafe_qty_units'] > 0:
-                    # Only warn if there were quantities but no weight
-                    print(
-                        f"  WARNING: Cannot calculate gram needs for variant '{v_data['variant_title']}' of '{product_title}' due to missing weight per item.")
-
+            for variant_title in missing_weight_titles[idx]:
+                print(
+                    f"  WARNING: Cannot calculate gram needs for variant '{variant_title}' of '{product_title}' due to missing weight per item.")
             data['total_roasted_grams_product'] = total_roasted_grams_for_product
-
             print(f"{product_title}\t{total_roasted_grams_for_product:,.2f}")
         print(f"\n\nTotal bags: {total_bags}")
         print(f"\n\n--- Label Needs --- DOES NOT INCLUDE WHOLESALE ---")
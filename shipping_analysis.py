@@ -1,15 +1,23 @@
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
 from shopify_reports import fetch_all_orders
 
 INPUT_CSV = "expensereport.csv"
 OUTPUT_XLSX = "shipping_analysis.xlsx"
 BOX_COST = 1.0
+UTC_OFFSET_PATTERN = r"(?:Z|[+-]\d{2}:?\d{2})$"
 
-# Load the expense report
-exp = pd.read_csv(INPUT_CSV)
-
-# Filter only shipping fees
-ship = exp[exp["Product category"] == "shipping_fee"].copy()
+# Load the expense report and keep only shipping fees. The filter runs on the Arrow table so only the
+# matching rows are converted to pandas. "Created at" stays a string so its UTC offset is handled below
+# exactly as before rather than being normalized to UTC by Arrow.
+# The other date columns stay strings too, so RawShipping keeps the report's original YYYY-MM-DD text.
+exp = pa_csv.read_csv(INPUT_CSV, convert_options=pa_csv.ConvertOptions(column_types={
+    column: pa.string() for column in ("Created at", "Bill date", "Cycle start", "Cycle end")
+}))
+ship = exp.filter(pc.equal(exp["Product category"], "shipping_fee")).to_pandas()
 ship["Created at"] = pd.to_datetime(ship["Created at"]).dt.tz_localize(None)
 ship["month"] = ship["Created at"].dt.to_period("M")
 
@@ -21,24 +29,43 @@ ship_cost_by_month = ship.groupby("month")["Billed amount"].sum()
 
 # Pull order data from Shopify to better estimate shipping revenue
 orders = fetch_all_orders()
-order_rows = []
-for o in orders:
-    shipping_price = sum(float(sl.get("price", 0.0)) for sl in o.get("shipping_lines", []))
-    created = o.get("created_at")
-    order_rows.append(
-        {
-            "order_id": o.get("id"),
-            "created_at": pd.to_datetime(created).tz_localize(None),
-            "shipping_price": shipping_price,
-            "subtotal_price": float(o.get("subtotal_price", 0.0)),
-        }
-    )
+order_ids = [None] * len(orders)
+created_at = [None] * len(orders)
+subtotal_prices = np.empty(len(orders), dtype=np.float64)
+# Shipping line prices are collected flat, tagged with their order's index, and summed per order in one bincount.
+shipping_line_prices = []
+shipping_line_orders = []
+for i, o in enumerate(orders):
+    order_ids[i] = o.get("id")
+    created_at[i] = o.get("created_at")
+    for sl in o.get("shipping_lines", []):
+        shipping_line_prices.append(sl.get("price", 0.0))
+        shipping_line_orders.append(i)
+    subtotal_prices[i] = float(o.get("subtotal_price", 0.0))
+shipping_prices = np.bincount(
+    np.array(shipping_line_orders, dtype=np.intp),
+    weights=np.array(shipping_line_prices, dtype=np.float64),
+    minlength=len(orders),
+)
+
+orders_df = pd.DataFrame(
+    {
+        "order_id": order_ids,
+        # Strip the UTC offset before one vectorized parse so every order keeps its local wall-clock time.
+        "created_at": pd.to_datetime(
+            pd.Series(created_at, dtype=object).str.replace(UTC_OFFSET_PATTERN, "", regex=True), format="ISO8601"),
+        "shipping_price": shipping_prices,
+        "subtotal_price": subtotal_prices,
+    }
+)
+# Box fee and shipping revenue are derived from the price array directly rather than via frame columns.
+box_fees = np.where(shipping_prices > 0, BOX_COST, 0.0)
+shipping_revenues = shipping_prices - box_fees
 
-orders_df = pd.DataFrame(order_rows)
 if not orders_df.empty:
     orders_df["month"] = orders_df["created_at"].dt.to_period("M")
-    orders_df["box_fee"] = (orders_df["shipping_price"] > 0).astype(float) * BOX_COST
-    orders_df["shipping_revenue"] = orders_df["shipping_price"] - orders_df["box_fee"]
+    orders_df["box_fee"] = box_fees
+    orders_df["shipping_revenue"] = shipping_revenues
 else:
     orders_df = pd.DataFrame(
         columns=[
@@ -52,13 +79,13 @@ else:
         ]
     )
 
-shipping_revenue_est = orders_df["shipping_revenue"].sum()
-free_shipping_orders = orders_df[orders_df["shipping_revenue"] == 0]
-box_cost_free_shipping = (
-    len(free_shipping_orders[free_shipping_orders["shipping_price"] == 0]) * BOX_COST
-)
+# Summary figures come straight from boolean masks over the order arrays instead of filtered frame copies.
+is_free_shipping = shipping_revenues == 0
+
+shipping_revenue_est = shipping_revenues.sum()
+box_cost_free_shipping = np.count_nonzero(is_free_shipping & (shipping_prices == 0)) * BOX_COST
 free_shipping_cost_est = total_shipping_cost - shipping_revenue_est
-free_shipping_order_revenue = free_shipping_orders["subtotal_price"].sum()
+free_shipping_order_revenue = subtotal_prices[is_free_shipping].sum()
 free_shipping_cost_pct_of_revenue = (
     (free_shipping_cost_est / free_shipping_order_revenue) * 100
     if free_shipping_order_revenue
@@ -75,7 +102,7 @@ summary_df = pd.DataFrame(
     }
 )
 
-with pd.ExcelWriter(OUTPUT_XLSX, engine="openpyxl") as writer:
+with pd.ExcelWriter(OUTPUT_XLSX, engine="xlsxwriter") as writer:
     summary_df.to_excel(writer, index=False, sheet_name="Summary")
     ship_cost_by_month.to_frame(name="shipping_cost").to_excel(writer, sheet_name="MonthlyCost")
     orders_df.to_excel(writer, index=False, sheet_name="OrderShipping")
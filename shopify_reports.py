@@ -1,19 +1,46 @@
 # Basic Shopify lifetime reports generator
 
+import functools
+import itertools
 import os
+import pickle
+import re
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import pandas as pd
+from urllib.parse import quote
+from zoneinfo import ZoneInfo
+import numpy as np
+import orjson
+import xlsxwriter
+
+from roast_calculator import SHOPIFY_CACHE_DIR, gid_to_id, iter_bulk_query_rows, shopify_graphql
 
 load_dotenv()
 
 SHOPIFY_STORE_NAME = os.getenv("SHOPIFY_STORE_NAME")
 SHOPIFY_API_VERSION = os.getenv("SHOPIFY_API_VERSION", "2024-01")
 SHOPIFY_ADMIN_API_ACCESS_TOKEN = os.getenv("SHOPIFY_ADMIN_API_ACCESS_TOKEN")
+SHOPIFY_BASE_URL = (
+    f"https://{SHOPIFY_STORE_NAME}.myshopify.com/admin/api/{SHOPIFY_API_VERSION}/"
+    if SHOPIFY_STORE_NAME and SHOPIFY_API_VERSION else None
+)
+# Shared by every REST call so pagination reuses one keep-alive connection; rate-limited (429) and
+# transient 5xx responses are retried with backoff.
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=8,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]),
+))
+_NEXT_LINK_RE = re.compile(r'<([^>]+)>\s*;\s*rel="next"')
+PRODUCTS_CACHE_PATH = os.path.join(SHOPIFY_CACHE_DIR, f"{SHOPIFY_STORE_NAME}-{SHOPIFY_API_VERSION}-report-products.pickle")
 
 
+@functools.lru_cache(maxsize=1)
 def get_shopify_headers():
     if not SHOPIFY_ADMIN_API_ACCESS_TOKEN:
         raise ValueError("SHOPIFY_ADMIN_API_ACCESS_TOKEN not found in environment variables.")
@@ -24,153 +51,281 @@ def get_shopify_headers():
 
 
 def build_shopify_url(endpoint: str) -> str:
-    if not SHOPIFY_STORE_NAME or not SHOPIFY_API_VERSION:
+    if not SHOPIFY_BASE_URL:
         raise ValueError("SHOPIFY_STORE_NAME or SHOPIFY_API_VERSION not found in environment variables.")
-    return f"https://{SHOPIFY_STORE_NAME}.myshopify.com/admin/api/{SHOPIFY_API_VERSION}/{endpoint}"
+    return SHOPIFY_BASE_URL + endpoint
 
 
-def fetch_all_orders() -> list[dict]:
-    orders = []
-    endpoint = (
-        "orders.json?status=any&limit=250&fields=id,created_at,total_price,total_discounts,subtotal_price,shipping_lines,line_items"
-    )
+def iter_shopify_pages(endpoint: str, key: str):
+    """
+    Yields the `key` list of every page, following the Link header. Pages can only be discovered one at a
+    time, but the next request is sent as soon as the current page's headers arrive, so its round trip
+    overlaps with decoding and processing the current page.
+    """
     headers = get_shopify_headers()
-    while endpoint:
-        url = build_shopify_url(endpoint)
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        data = response.json().get("orders", [])
-        orders.extend(data)
-        link_header = response.headers.get("Link")
-        endpoint = None
-        if link_header:
-            links = link_header.split(",")
-            for link in links:
-                parts = link.split(";")
-                if 'rel="next"' in parts[1]:
-                    next_url = parts[0].strip()[1:-1]
-                    endpoint = next_url.split(f"/admin/api/{SHOPIFY_API_VERSION}/")[-1]
-                    break
-    def order_filter(order):
-        filter_out = {
-            'Iced Coffee',
-            'Pina Colada',
-            'Mojito',
-            'Espresso Lemonade',
-            'Iced Latte',
-            'Hot Coffee',
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = executor.submit(_SESSION.get, build_shopify_url(endpoint), headers=headers)
+        while pending:
+            response = pending.result()
+            response.raise_for_status()
+            next_link = _NEXT_LINK_RE.search(response.headers.get("Link", ""))
+            pending = executor.submit(_SESSION.get, next_link.group(1), headers=headers) if next_link else None
+            yield orjson.loads(response.content).get(key, [])
+
+
+ORDER_FILTER_OUT = {
+    'Iced Coffee',
+    'Pina Colada',
+    'Mojito',
+    'Espresso Lemonade',
+    'Iced Latte',
+    'Hot Coffee',
+}
+
+
+ORDERS_BULK_QUERY = """
+{
+  orders {
+    edges {
+      node {
+        id
+        createdAt
+        totalPriceSet { shopMoney { amount } }
+        totalDiscountsSet { shopMoney { amount } }
+        subtotalPriceSet { shopMoney { amount } }
+        shippingLines {
+          edges {
+            node {
+              originalPriceSet { shopMoney { amount } }
+            }
+          }
         }
-        return any([li for li in order['line_items'] if not li['name'] in filter_out])
-    return [o for o in orders if order_filter(o)]
+        lineItems {
+          edges {
+            node {
+              name
+              quantity
+              product { id }
+              variant { id }
+              originalUnitPriceSet { shopMoney { amount } }
+            }
+          }
+        }
+      }
+    }
+  }
+}
+"""
 
 
-def fetch_all_products() -> dict:
+def iter_orders():
+    """
+    Exports every order with one bulk operation instead of paging through orders.json, and yields them
+    shaped like the REST orders the report was written against, skipping orders made up only of cafe
+    drinks. GraphQL timestamps are UTC, so created_at is converted back to the shop's timezone as REST
+    returns it. Result rows are parsed as they download, but a line item's row only names its order by
+    `__parentId`, so orders are yielded once the export has been read.
+    """
+    shop_timezone = ZoneInfo(shopify_graphql("{ shop { ianaTimezone } }")["shop"]["ianaTimezone"])
+    orders = {}
+    for row in iter_bulk_query_rows(ORDERS_BULK_QUERY):
+        parent_id = row.get("__parentId")
+        if parent_id is None:
+            orders[row["id"]] = {
+                "id": gid_to_id(row["id"]),
+                "created_at": datetime.fromisoformat(row["createdAt"]).astimezone(shop_timezone).isoformat(),
+                "total_price": row["totalPriceSet"]["shopMoney"]["amount"],
+                "total_discounts": row["totalDiscountsSet"]["shopMoney"]["amount"],
+                "subtotal_price": row["subtotalPriceSet"]["shopMoney"]["amount"],
+                "shipping_lines": [],
+                "line_items": [],
+            }
+        elif "originalUnitPriceSet" in row:
+            orders[parent_id]["line_items"].append({
+                "name": row["name"],
+                "quantity": row["quantity"],
+                "product_id": gid_to_id(row["product"]["id"]) if row["product"] else None,
+                "variant_id": gid_to_id(row["variant"]["id"]) if row["variant"] else None,
+                "price": row["originalUnitPriceSet"]["shopMoney"]["amount"],
+            })
+        else:
+            orders[parent_id]["shipping_lines"].append({"price": row["originalPriceSet"]["shopMoney"]["amount"]})
+
+    for order in orders.values():
+        if any(li['name'] not in ORDER_FILTER_OUT for li in order['line_items']):
+            yield order
+
+
+def fetch_all_orders() -> list[dict]:
+    return list(iter_orders())
+
+
+def fetch_products(updated_at_min: str | None = None) -> dict:
     products = {}
-    endpoint = "products.json?limit=250&fields=id,title,variants"
-    headers = get_shopify_headers()
-    while endpoint:
-        url = build_shopify_url(endpoint)
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        data = response.json().get("products", [])
+    endpoint = "products.json?limit=250&fields=id,title,variants,updated_at"
+    if updated_at_min:
+        endpoint += f"&updated_at_min={quote(updated_at_min)}"
+    for data in iter_shopify_pages(endpoint, "products"):
         for product in data:
             products[product["id"]] = product
-        link_header = response.headers.get("Link")
-        endpoint = None
-        if link_header:
-            links = link_header.split(",")
-            for link in links:
-                parts = link.split(";")
-                if 'rel="next"' in parts[1]:
-                    next_url = parts[0].strip()[1:-1]
-                    endpoint = next_url.split(f"/admin/api/{SHOPIFY_API_VERSION}/")[-1]
-                    break
     return products
 
 
+def fetch_product_count() -> int:
+    response = _SESSION.get(build_shopify_url("products/count.json"), headers=get_shopify_headers())
+    response.raise_for_status()
+    return orjson.loads(response.content)["count"]
 
 
-def collect_metrics(orders: list[dict], products: dict) -> dict:
-    shipping_paid_by_customers = 0.0
-    product_revenue = defaultdict(float)
-    order_shipping_rows = []
+def fetch_all_products() -> dict:
+    """
+    Returns the catalogue keyed by product id. It rarely changes, so the last result is pickled under
+    SHOPIFY_CACHE_DIR and later runs only fetch products updated since the newest one in it. Deleted
+    products don't show up in that query, so a cached catalogue whose size no longer matches the store's
+    product count is fetched again in full.
+    """
+    products = None
+    try:
+        with open(PRODUCTS_CACHE_PATH, "rb") as f:
+            products = pickle.load(f)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Ignoring unreadable product cache {PRODUCTS_CACHE_PATH}: {e}")
+
+    if products:
+        last_updated_at = max((p["updated_at"] for p in products.values()), key=datetime.fromisoformat)
+        products.update(fetch_products(last_updated_at))
+        if len(products) != fetch_product_count():
+            products = None
+    if not products:
+        products = fetch_products()
+
+    try:
+        os.makedirs(SHOPIFY_CACHE_DIR, exist_ok=True)
+        with open(PRODUCTS_CACHE_PATH, "wb") as f:
+            pickle.dump(products, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError as e:
+        print(f"Could not write product cache {PRODUCTS_CACHE_PATH}: {e}")
+    return products
+
 
-    for order in orders:
-        created = order.get("created_at")
-        order_id = order.get("id")
-        lines = order.get("shipping_lines", [])
-        total_paid_shipping = 0.0
-        for sl in lines:
-            price = float(sl.get("price", 0.0))
-            total_paid_shipping += price
 
-        shipping_paid_by_customers += total_paid_shipping
-        order_shipping_rows.append(
-            {
-                "order_id": order_id,
-                "created_at": created,
-                "shipping_paid_by_customer": total_paid_shipping,
-            }
-        )
 
+def summarize_orders(orders) -> dict:
+    """
+    Aggregates the order side of the report in a single pass, so `orders` can be a stream such as
+    iter_orders(): only the per-order shipping columns and the flat price lists are kept, never the orders.
+    Prices are summed per order / per product with bincount, keyed by each value's position in the
+    stream or in first-seen product order.
+    """
+    order_ids = []
+    created_at = []
+    order_totals = []  # (total_price, total_discounts) per order
+    shipping_line_prices = []
+    shipping_line_orders = []
+    item_prices = []
+    item_quantities = []
+    item_product_codes = []
+    product_codes = {}
+    for i, order in enumerate(orders):
+        order_ids.append(order.get("id"))
+        created_at.append(order.get("created_at"))
+        order_totals.append((order.get("total_price", 0.0), order.get("total_discounts", 0.0)))
+        for sl in order.get("shipping_lines", []):
+            shipping_line_prices.append(sl.get("price", 0.0))
+            shipping_line_orders.append(i)
         for item in order.get("line_items", []):
-            product_id = item.get("product_id")
-            quantity = item.get("quantity", 0)
-            price = float(item.get("price", 0.0))
-            product_revenue[product_id] += price * quantity
-
-    sold_out_product_revenue = {}
-    for pid, pdata in products.items():
-        all_oos = True
-        for variant in pdata.get("variants", []):
-            if variant.get("inventory_quantity", 0) > 0:
-                all_oos = False
-                break
-        if all_oos:
-            sold_out_product_revenue[pdata["title"]] = product_revenue.get(pid, 0.0)
+            item_product_codes.append(product_codes.setdefault(item.get("product_id"), len(product_codes)))
+            item_prices.append(item.get("price", 0.0))
+            item_quantities.append(item.get("quantity", 0))
+    total_orders = len(order_ids)
 
+    paid_shipping = np.bincount(
+        np.array(shipping_line_orders, dtype=np.intp),
+        weights=np.array(shipping_line_prices, dtype=np.float64),
+        minlength=total_orders,
+    )
+
+    item_revenue = np.array(item_prices, dtype=np.float64) * np.array(item_quantities, dtype=np.float64)
+    revenue_by_code = np.bincount(
+        np.array(item_product_codes, dtype=np.intp), weights=item_revenue, minlength=len(product_codes))
+
+    # Both totals come from one conversion; summing down the columns adds orders in sequence.
+    total_revenue, total_discounts = np.array(order_totals, dtype=np.float64).reshape(-1, 2).sum(axis=0).tolist()
     summary = {
-        "total_orders": len(orders),
-        "total_revenue": sum(float(o.get("total_price", 0.0)) for o in orders),
-        "total_discounts": sum(float(o.get("total_discounts", 0.0)) for o in orders),
-        "shipping_paid_by_customers": shipping_paid_by_customers,
-        "average_order_value": (sum(float(o.get("total_price", 0.0)) for o in orders) / len(orders)) if orders else 0.0,
+        "total_orders": total_orders,
+        "total_revenue": total_revenue,
+        "total_discounts": total_discounts,
+        "shipping_paid_by_customers": float(paid_shipping.sum()),
+        "average_order_value": (total_revenue / total_orders) if total_orders else 0.0,
+    }
+
+    return {
+        "summary": summary,
+        "shipping_columns": {
+            "order_id": order_ids,
+            "created_at": created_at,
+            "shipping_paid_by_customer": paid_shipping,
+        },
+        "product_revenue": dict(zip(product_codes, revenue_by_code.tolist())),
     }
 
-    product_revenue_named = {
-        products[pid]["title"] if pid in products else str(pid): rev
-        for pid, rev in product_revenue.items()
+
+def add_product_metrics(order_metrics: dict, products: dict) -> dict:
+    product_revenue = order_metrics["product_revenue"]
+
+    sold_out_product_revenue = {
+        pdata["title"]: product_revenue.get(pid, 0.0)
+        for pid, pdata in products.items()
+        if not any(variant.get("inventory_quantity", 0) > 0 for variant in pdata.get("variants", []))
     }
 
+    titles = {pid: pdata["title"] for pid, pdata in products.items()}
+    product_revenue_named = {titles.get(pid, str(pid)): rev for pid, rev in product_revenue.items()}
+
     return {
-        "summary": summary,
-        "shipping_rows": order_shipping_rows,
+        "summary": order_metrics["summary"],
+        "shipping_columns": order_metrics["shipping_columns"],
         "sold_out_product_revenue": sold_out_product_revenue,
         "product_revenue": product_revenue_named,
     }
 
 
+def collect_metrics(orders, products: dict) -> dict:
+    return add_product_metrics(summarize_orders(orders), products)
+
+
 def write_excel_report(metrics: dict, filename: str):
-    summary_df = pd.DataFrame([metrics["summary"]])
-    shipping_df = pd.DataFrame(metrics["shipping_rows"])
-    sold_out_df = (
-        pd.DataFrame(list(metrics["sold_out_product_revenue"].items()), columns=["product", "revenue"])
-        if metrics["sold_out_product_revenue"]
-        else pd.DataFrame(columns=["product", "revenue"])
-    )
-    product_rev_df = pd.DataFrame(list(metrics["product_revenue"].items()), columns=["product", "revenue"])
+    """
+    Streams every sheet straight into the workbook in constant_memory mode, so each row is flushed to
+    disk as it is written rather than first building a DataFrame per sheet.
+    """
+    shipping = metrics["shipping_columns"]
+    sheets = {
+        "Summary": (list(metrics["summary"]), [list(metrics["summary"].values())]),
+        "Shipping": (
+            list(shipping),
+            zip(shipping["order_id"], shipping["created_at"], shipping["shipping_paid_by_customer"].tolist()),
+        ),
+        "SoldOutProducts": (["product", "revenue"], metrics["sold_out_product_revenue"].items()),
+        "ProductRevenue": (["product", "revenue"], metrics["product_revenue"].items()),
+    }
 
-    with pd.ExcelWriter(filename, engine="openpyxl") as writer:
-        summary_df.to_excel(writer, index=False, sheet_name="Summary")
-        shipping_df.to_excel(writer, index=False, sheet_name="Shipping")
-        sold_out_df.to_excel(writer, index=False, sheet_name="SoldOutProducts")
-        product_rev_df.to_excel(writer, index=False, sheet_name="ProductRevenue")
+    workbook = xlsxwriter.Workbook(filename, {"constant_memory": True})
+    for sheet_name, (header, rows) in sheets.items():
+        worksheet = workbook.add_worksheet(sheet_name)
+        for row_number, row in enumerate(itertools.chain([header], rows)):
+            worksheet.write_row(row_number, 0, row)
+    workbook.close()
 
 
 def main():
-    orders = fetch_all_orders()
-    products = fetch_all_products()
-    metrics = collect_metrics(orders, products)
+    # Products are fetched in the background while the order pages stream through summarize_orders.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        products_future = executor.submit(fetch_all_products)
+        order_metrics = summarize_orders(iter_orders())
+        metrics = add_product_metrics(order_metrics, products_future.result())
     timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
     filename = f"shopify_report_{timestamp}.xlsx"
     write_excel_report(metrics, filename)
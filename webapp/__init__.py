@@ -3,6 +3,7 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_bcrypt import Bcrypt
 from flask_migrate import Migrate
+from argon2 import PasswordHasher
 
 # Initialize extensions
 
@@ -10,6 +11,8 @@ db = SQLAlchemy()
 login_manager = LoginManager()
 bcrypt = Bcrypt()
 migrate = Migrate()
+# New passwords are hashed with argon2id; bcrypt above only verifies hashes stored before the switch.
+password_hasher = PasswordHasher(time_cost=2, memory_cost=64 * 1024, parallelism=2)
 
 
 def create_app():
@@ -1,6 +1,7 @@
 from datetime import datetime
+from argon2.exceptions import InvalidHashError, VerificationError
 from flask_login import UserMixin
-from .. import db, login_manager, bcrypt
+from .. import db, login_manager, bcrypt, password_hasher
 
 
 class User(db.Model, UserMixin):
@@ -16,10 +17,23 @@ class User(db.Model, UserMixin):
     suggestions = db.relationship('Suggestion', backref='author', lazy=True)
 
     def set_password(self, password: str):
-        self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password: str) -> bool:
-        return bcrypt.check_password_hash(self.password_hash, password)
+        """Verifies `password`, rehashing it with the current argon2 parameters when the stored hash is a
+        legacy bcrypt hash or uses outdated ones. The caller commits the session to keep the new hash."""
+        if self.password_hash.startswith('$2'):
+            if not bcrypt.check_password_hash(self.password_hash, password):
+                return False
+            self.set_password(password)
+            return True
+        try:
+            password_hasher.verify(self.password_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False
+        if password_hasher.check_needs_rehash(self.password_hash):
+            self.set_password(password)
+        return True
 
 
 @login_manager.user_loader
@@ -54,7 +68,7 @@ class GreenData(db.Model):
     added = db.Column(db.Date)
     removed = db.Column(db.Date)
 
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # the index page lists newest first
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     notes = db.relationship('TastingNote', backref='green', lazy=True)
@@ -82,6 +96,8 @@ class Suggestion(db.Model):
 
 
 class SuggestionVote(db.Model):
+    __table_args__ = (db.UniqueConstraint('user_id', 'suggestion_id', name='uq_suggestion_vote_user'),)
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     suggestion_id = db.Column(db.Integer, db.ForeignKey('suggestion.id'))
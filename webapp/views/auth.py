@@ -27,6 +27,7 @@ def login():
     if form.validate_on_submit():
         user = User.query.filter_by(username=form.username.data).first()
         if user and user.check_password(form.password.data):
+            db.session.commit()  # keeps a hash check_password upgraded
             login_user(user, remember=form.remember_me.data)
             return redirect(url_for('main.index'))
         else:
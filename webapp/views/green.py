@@ -1,10 +1,11 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, current_app, render_template, redirect, url_for, flash, request
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
 import os
-import json
+import orjson
 
-import dataclasses
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import insert, update
 from green_scraper import (
     extract_text_from_pdf,
     extract_structured_data_from_pdf_text_via_ai,
@@ -17,12 +18,72 @@ from ..forms import GreenUploadForm, TastingNoteForm
 
 green_bp = Blueprint('green', __name__, url_prefix='/green')
 UPLOAD_FOLDER = 'uploads'
+# Uploads are parsed off the request thread; two workers keep concurrent AI calls modest.
+extraction_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='green-upload')
+GREEN_DATA_ITEM_COLUMNS = (
+    'name', 'url', 'importer', 'farm', 'country', 'arrival', 'cupping_notes', 'variety', 'quantity_available',
+    'size_units', 'size_value', 'price_units', 'price_value', 'added', 'removed',
+)
 
 
 def ensure_upload_folder():
     os.makedirs(os.path.join(os.getcwd(), UPLOAD_FOLDER), exist_ok=True)
 
 
+def green_data_row(item, filename, manual_data, uploaded_by) -> dict:
+    """Column values for one parsed item, or a bare upload record when `item` is None. Every row has the
+    same keys, as an executemany INSERT requires."""
+    row = dict.fromkeys(GREEN_DATA_ITEM_COLUMNS)
+    row.update(filename=filename, manual_data=manual_data, uploaded_by=uploaded_by)
+    if item:
+        row.update(
+            name=item.name,
+            url=item.url,
+            importer=item.importer,
+            farm=item.farm,
+            country=item.country,
+            arrival=item.arrival,
+            cupping_notes=item.cupping_notes,
+            variety=item.variety,
+            added=item.added,
+            removed=item.removed,
+        )
+        if item.quantity_available:
+            row['quantity_available'] = orjson.dumps(item.quantity_available).decode()
+        if item.size:
+            row['size_units'] = item.size.units
+            row['size_value'] = item.size.value
+        if item.price:
+            row['price_units'] = item.price.units
+            row['price_value'] = item.price.value
+    return row
+
+
+def process_green_upload(app, green_id, pdf_bytes, manual_data):
+    """Parses an upload recorded by upload_green. Its placeholder row takes the first parsed item, and
+    any further items are inserted alongside it; if nothing parses, the placeholder stays as the record."""
+    with app.app_context():
+        try:
+            green = db.session.get(GreenData, green_id)
+            pdf_text = extract_text_from_pdf(green.filename, stream=pdf_bytes) if pdf_bytes else None
+            text_source = manual_data or pdf_text
+            parsed_items = []
+            if text_source:
+                parsed_items = extract_structured_data_from_pdf_text_via_ai(text_source, green.filename or "manual")
+            rows = [green_data_row(item, green.filename, text_source, green.uploaded_by) for item in parsed_items]
+            if not rows:
+                rows = [green_data_row(None, green.filename, text_source, green.uploaded_by)]
+
+            db.session.execute(update(GreenData).where(GreenData.id == green_id).values(**rows[0]))
+            if rows[1:]:
+                # One executemany INSERT for the remaining items instead of a unit-of-work flush per object.
+                db.session.execute(insert(GreenData), rows[1:])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            app.logger.exception("Failed to parse green upload %s", green_id)
+
+
 @green_bp.route('/upload', methods=['GET', 'POST'])
 @login_required
 def upload_green():
@@ -30,50 +91,25 @@ def upload_green():
     ensure_upload_folder()
     if form.validate_on_submit():
         filename = None
-        pdf_text = None
-        parsed_items = []
+        pdf_bytes = None
         if form.file.data:
+            # Read the upload once: the bytes are both saved and handed to the parser, which then
+            # doesn't have to read the file back from disk.
             filename = secure_filename(form.file.data.filename)
-            save_path = os.path.join(UPLOAD_FOLDER, filename)
-            form.file.data.save(save_path)
-            pdf_text = extract_text_from_pdf(save_path)
-        text_source = form.manual_data.data or pdf_text
-        if text_source:
-            parsed_items = extract_structured_data_from_pdf_text_via_ai(text_source, filename or "manual")
-        if not parsed_items:
-            parsed_items = [None]
-
-        for item in parsed_items:
-            green = GreenData(
-                filename=filename,
-                manual_data=text_source,
-                uploader=current_user,
-            )
-            if item:
-                green.name = item.name
-                green.url = item.url
-                green.importer = item.importer
-                green.farm = item.farm
-                green.country = item.country
-                green.arrival = item.arrival
-                green.cupping_notes = item.cupping_notes
-                green.variety = item.variety
-                if item.quantity_available:
-                    green.quantity_available = json.dumps([
-                        dataclasses.asdict(q) for q in item.quantity_available
-                    ])
-                if item.size:
-                    green.size_units = item.size.units
-                    green.size_value = item.size.value
-                if item.price:
-                    green.price_units = item.price.units
-                    green.price_value = item.price.value
-                green.added = item.added
-                green.removed = item.removed
-            db.session.add(green)
+            pdf_bytes = form.file.data.read()
+            with open(os.path.join(UPLOAD_FOLDER, filename), 'wb') as f:
+                f.write(pdf_bytes)
+        manual_data = form.manual_data.data or None
 
+        # Record the upload now and parse it in the background: PDF extraction and the AI call can take
+        # minutes, far longer than a request should be held open.
+        green = GreenData(filename=filename, manual_data=manual_data, uploader=current_user)
+        db.session.add(green)
         db.session.commit()
-        flash('Green data uploaded.', 'success')
+        extraction_executor.submit(
+            process_green_upload, current_app._get_current_object(), green.id, pdf_bytes, manual_data
+        )
+        flash('Green data uploaded. It will be parsed in the background.', 'success')
         return redirect(url_for('main.index'))
     return render_template('upload.html', form=form)
 
@@ -1,5 +1,6 @@
 from flask import Blueprint, render_template
 from flask_login import login_required
+from sqlalchemy.orm import joinedload
 
 from ..models import GreenData
 
@@ -9,5 +10,6 @@ main_bp = Blueprint('main', __name__)
 @main_bp.route('/')
 @login_required
 def index():
-    greens = GreenData.query.order_by(GreenData.created_at.desc()).all()
+    # The table shows each uploader's name, so load them in the same query rather than one per row.
+    greens = GreenData.query.options(joinedload(GreenData.uploader)).order_by(GreenData.created_at.desc()).all()
     return render_template('index.html', greens=greens)